@@ -0,0 +1,60 @@
+"""
+Feed Proxy API: common package; queued access logging module
+"""
+
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+from typing import Optional
+
+from feed_proxy.common.metrics import metrics
+
+ACCESS_LOGGER = 'feed_proxy.access'
+
+access_logger = logging.getLogger(ACCESS_LOGGER)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    A queue handler that drops records, rather than blocking or erroring, when its queue is full
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('logging.access.dropped')
+
+
+def start_access_log(queue_size: int) -> Optional[QueueListener]:
+    """
+    Send the access log through a bounded queue to the gunicorn error log's handlers, written out
+    by a background thread so logging a request never waits on I/O; returns the listener to stop
+    on shutdown, or None if there are no handlers to write to
+    """
+
+    target = logging.getLogger('gunicorn.error')
+    if not target.handlers:
+        return None
+
+    records: queue.Queue = queue.Queue(maxsize=queue_size)
+    access_logger.handlers = [DroppingQueueHandler(records)]
+    access_logger.setLevel(target.getEffectiveLevel())
+    access_logger.propagate = False
+
+    listener = QueueListener(records, *target.handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_access_log(listener: Optional[QueueListener]) -> None:
+    """
+    Flush any queued access log records and stop the background writer
+    """
+
+    if listener is None:
+        return
+
+    listener.stop()
+    access_logger.handlers = []
+    access_logger.propagate = True
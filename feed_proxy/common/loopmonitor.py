@@ -0,0 +1,158 @@
+"""
+Feed Proxy API: common package; event loop lag monitor module
+"""
+
+import asyncio
+from collections import deque
+from functools import lru_cache
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Deque, Dict, Optional
+
+import humanfriendly
+
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+
+LAG_SAMPLES = 1024
+MAX_REPORTS = 20
+STACK_LIMIT = 30
+PERCENTILES = (50, 95, 99)
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class LoopMonitor:
+    """
+    Measures the event loop's lag, how late a periodic tick runs, and catches blocking calls
+
+    A watchdog thread checks the tick's heartbeat; when the loop has been blocked for longer than
+    threshold seconds it captures the stack of the event loop thread, which is the call doing the
+    blocking, and logs and keeps it. Each blocking stall is reported once.
+    """
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        self._interval = interval
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._lags: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self._reports: Deque[dict] = deque(maxlen=MAX_REPORTS)
+        self._heartbeat = time.monotonic()
+        self._reported: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """
+        Start monitoring the running event loop
+        """
+
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+        for percentile in PERCENTILES:
+            metrics.gauge(f'loop.lag.p{percentile}', self._percentile_gauge(percentile))
+        metrics.gauge('loop.lag.max', self._percentile_gauge(100))
+
+    def stop(self) -> None:
+        """
+        Stop monitoring
+        """
+
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Get a percentile of the recent event loop lag, in seconds
+        """
+
+        with self._lock:
+            lags = sorted(self._lags)
+
+        if not lags:
+            return 0.0
+
+        rank = max(1, math.ceil(percentile / 100 * len(lags)))
+        return round(lags[rank - 1], 4)
+
+    def report(self) -> dict:
+        """
+        Get the recent lag percentiles and the most recent blocking calls caught
+        """
+
+        with self._lock:
+            blocked = list(self._reports)
+
+        lag: Dict[str, float] = {
+            f'p{percentile}': self.percentile(percentile)
+            for percentile in PERCENTILES
+        }
+        lag['max'] = self.percentile(100)
+        return {'lag': lag, 'blocked': blocked}
+
+    def _percentile_gauge(self, percentile: float) -> Callable[[], float]:
+        def _gauge() -> float:
+            return self.percentile(percentile)
+
+        return _gauge
+
+    async def _tick(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            with self._lock:
+                self._lags.append(max(0.0, now - start - self._interval))
+                self._heartbeat = now
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self._threshold / 2):
+            with self._lock:
+                heartbeat = self._heartbeat
+
+            blocked = time.monotonic() - heartbeat - self._interval
+            if blocked < self._threshold or heartbeat == self._reported:
+                continue
+
+            if self._loop_thread is None:
+                continue
+
+            self._reported = heartbeat
+            frames = sys._current_frames()    # pylint: disable=protected-access
+            frame = frames.get(self._loop_thread)
+            stack = traceback.format_stack(frame, limit=STACK_LIMIT) if frame else []
+            with self._lock:
+                self._reports.append({
+                    'at': round(time.time(), 3),
+                    'blocked': round(blocked, 3),
+                    'stack': [line.rstrip() for line in stack]
+                })
+
+            metrics.increment('loop.blocked')
+            logger.warning('Event loop blocked for at least %.3fs in:\n%s', blocked, ''.join(stack))
+
+
+@lru_cache
+def loop_monitor() -> Optional[LoopMonitor]:
+    """
+    Get and return the event loop monitor, or None if it's turned off
+    """
+
+    settings = get_settings()
+    if not settings.loop_monitor:
+        return None
+
+    return LoopMonitor(
+        interval=humanfriendly.parse_timespan(settings.loop_monitor_interval),
+        threshold=humanfriendly.parse_timespan(settings.loop_blocked_threshold)
+    )
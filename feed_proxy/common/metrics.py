@@ -0,0 +1,75 @@
+"""
+Feed Proxy API: common package; per worker metrics module
+"""
+
+import os
+import threading
+from typing import Callable, Dict, Union
+
+Number = Union[int, float]
+
+
+class Metrics:
+    """
+    A minimal, thread safe registry of per worker counters and gauges
+
+    Counters are incremented in place; gauges are either set directly or registered as callables
+    that are evaluated when a snapshot is taken.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Number] = {}
+        self._gauges: Dict[str, Number] = {}
+        self._callbacks: Dict[str, Callable[[], Number]] = {}
+
+    def increment(self, name: str, value: Number = 1) -> None:
+        """
+        Increment a counter
+        """
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value: Number) -> None:
+        """
+        Set a gauge's current value
+        """
+
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauge(self, name: str, callback: Callable[[], Number]) -> None:
+        """
+        Register a gauge whose value is computed when a snapshot is taken
+        """
+
+        with self._lock:
+            self._callbacks[name] = callback
+
+    def counter(self, name: str) -> Number:
+        """
+        Get a counter's current value
+        """
+
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Get the current value of all counters and gauges
+        """
+
+        with self._lock:
+            values = {**self._counters, **self._gauges}
+            callbacks = dict(self._callbacks)
+
+        for name, callback in callbacks.items():
+            values[name] = callback()
+
+        return {
+            'worker': os.getpid(),
+            'metrics': dict(sorted(values.items()))
+        }
+
+
+metrics = Metrics()
@@ -2,15 +2,39 @@
 Feed Proxy API: common package; middleware module
 """
 
+import asyncio
+from collections import OrderedDict
+from functools import lru_cache
+import gzip
+import hashlib
+from http import HTTPStatus
 import logging
+from pathlib import Path
+import random
 import re
+import threading
 import time
-from typing import List, Optional
+from typing import List, Optional, Set, Tuple
 
 from fastapi import FastAPI
-from starlette.datastructures import MutableHeaders, URL
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.types import Message, Receive, Scope, Send
 
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+
+try:
+    import brotli    # type: ignore[import]
+except ImportError:    # pragma: no cover
+    brotli = None
+
+STALE_PURGE_MARKER = '.stale-purged'
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml', 'text/'
+)
+
 # CODE HEALTH WARNING:
 #
 # This module uses "pure" ASGI Starlette middleware and not FastAPI middleware.
@@ -37,6 +61,11 @@ logger = logging.getLogger('gunicorn.error')
 class RouteLoggerMiddleware:    # pylint: disable=too-few-public-methods
     """
     ASGI middleware to log all API routes accessed
+
+    Skipped routes and regexes are compiled into a single matcher, checked once per request
+    before anything else is done. With a sample_rate below 1 only that fraction of successful
+    requests are logged; client and server errors are always logged. Each record carries the
+    request's details as structured extra fields.
     """
     def __init__(
         self,
@@ -45,62 +74,70 @@ class RouteLoggerMiddleware:    # pylint: disable=too-few-public-methods
         route_logger: Optional[logging.Logger] = None,
         level: Optional[int] = None,
         skip_routes: Optional[List[str]] = None,
-        skip_regexes: Optional[List[str]] = None
+        skip_regexes: Optional[List[str]] = None,
+        sample_rate: float = 1.0
     ) -> None:
         self._app = app
         self._logger = route_logger if route_logger else logging.getLogger('gunicorn.error')
         self._level = level if level else logging.DEBUG
-        self._skip_routes = skip_routes if skip_routes else []
-        self._skip_regexes = (
-            list(map(lambda regex: re.compile(regex),   # pylint: disable=unnecessary-lambda
-                     skip_regexes)) if skip_regexes else []
+        self._sample_rate = sample_rate
+        patterns = [re.escape(route) for route in skip_routes or []] + list(skip_regexes or [])
+        self._skip = (
+            re.compile('|'.join(f'(?:{pattern})' for pattern in patterns)) if patterns else None
         )
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self._app(scope, receive, send)
 
-        if scope['type'] not in ('http', 'websocket'):
-            await self._app(scope, receive, send)
+        path = scope.get('root_path', '') + scope['path']
+        if self._skip is not None and self._skip.match(path):
+            return await self._app(scope, receive, send)
 
-        url = URL(scope=scope)
-        client_ip, _client_port = scope['client']
         status = 500
         start_time = time.perf_counter()
-        query_params = f'?{url.query}' if url.query else ''
-
-        async def receive_wrapper() -> Message:
-            message = await receive()
-            return message
 
         async def send_wrapper(message: Message) -> None:
             # Code Health Warning
-            # Note the use of nonlocal below so send_wrapper inherits the status and
-            # start_time variables from the containing scope of __call__
+            # Note the use of nonlocal below so send_wrapper inherits the status variable from
+            # the containing scope of __call__
             nonlocal status
-            nonlocal start_time
             if message['type'] == 'http.response.start':
                 status = message['status']
 
             await send(message)
 
-            if message['type'] == 'http.response.body':
-                if not self._skip_this_route(url):
-                    elapsed = time.perf_counter() - start_time
-                    logger.info(
-                        '%s - %s %s%s, %s, took=%s',
-                        client_ip,
-                        scope['method'],
-                        url.path,
-                        query_params,
-                        status,
-                        f'{elapsed:0.4f}s'
-                    )
-
-        await self._app(scope, receive_wrapper, send_wrapper)
-
-    def _skip_this_route(self, url: URL) -> bool:
-        return any(
-            [True for path in self._skip_routes if url.path.startswith(path)] +    # noqa: W504
-            [True for regex in self._skip_regexes if regex.match(url.path)]
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                self._log(scope, path, status, time.perf_counter() - start_time)
+
+        return await self._app(scope, receive, send_wrapper)
+
+    def _log(self, scope: Scope, path: str, status: int, elapsed: float) -> None:
+        if not self._logger.isEnabledFor(self._level):
+            return
+        if status < 400 and self._sample_rate < 1.0 and random.random() >= self._sample_rate:
+            return
+
+        client_ip = scope['client'][0] if scope.get('client') else '-'
+        query = scope['query_string'].decode('latin-1')
+        query_params = f'?{query}' if query else ''
+        self._logger.log(
+            self._level,
+            '%s - %s %s%s, %s, took=%s',
+            client_ip,
+            scope['method'],
+            path,
+            query_params,
+            status,
+            f'{elapsed:0.4f}s',
+            extra={
+                'client_ip': client_ip,
+                'method': scope['method'],
+                'path': path,
+                'query': query,
+                'status': status,
+                'elapsed': round(elapsed, 4)
+            }
         )
 
 
@@ -126,3 +163,359 @@ class TransactionTimeMiddleware:    # pylint: disable=too-few-public-methods
 
         start_time = time.perf_counter()
         await self._app(scope, receive, send_wrapper)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Choose the best response encoding a client accepts, brotli if it's available or gzip, from an
+    Accept-Encoding header; None if neither is acceptable
+    """
+
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+
+    wildcard = accepted.get('*', 0.0)
+    offered = (['br'] if brotli is not None else []) + ['gzip']
+    best = max(offered, key=lambda coding: accepted.get(coding, wildcard))
+    return best if accepted.get(best, wildcard) > 0 else None
+
+
+class CompressedBodies:
+    """
+    A thread safe LRU of compressed response bodies, keyed by a hash of the uncompressed body and
+    the encoding, so an unchanged response is only compressed once
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._bodies: OrderedDict[Tuple[bytes, str], bytes] = OrderedDict()
+
+    def get(self, key: Tuple[bytes, str]) -> Optional[bytes]:
+        """
+        Get a compressed body, if there is one
+        """
+
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, key: Tuple[bytes, str], body: bytes) -> None:
+        """
+        Store a compressed body, evicting the least recently used if full
+        """
+
+        with self._lock:
+            self._bodies[key] = body
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self._max_entries:
+                self._bodies.popitem(last=False)
+
+
+class CompressionMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    ASGI middleware to compress responses with brotli or gzip, as negotiated via Accept-Encoding
+
+    Only complete, single message responses of a compressible type and at least min_size bytes
+    are compressed; streamed responses pass through untouched. Compressed bodies are cached by
+    content hash, so compression happens once per content change rather than once per request.
+    """
+    def __init__(
+        self,
+        app: FastAPI,
+        *,
+        min_size: int = 500,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+        cache_entries: int = 256
+    ) -> None:
+        self._app = app
+        self._min_size = min_size
+        self._gzip_level = gzip_level
+        self._brotli_quality = brotli_quality
+        self._bodies = CompressedBodies(cache_entries)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self._app(scope, receive, send)
+
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                headers = Headers(raw=message['headers'])
+                content_type = headers.get('content-type', '')
+                compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+                passthrough = 'content-encoding' in headers or not compressible
+                if passthrough:
+                    await send(message)
+                return
+
+            if passthrough or start is None or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            if message.get('more_body', False) or len(body) < self._min_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers = MutableHeaders(scope=start)
+            if 'accept-encoding' not in headers.get('vary', '').lower():
+                headers.add_vary_header('Accept-Encoding')
+            if encoding is not None:
+                body = self._compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+                headers['Content-Length'] = str(len(body))
+                etag = headers.get('etag')
+                if etag and etag.endswith('"'):
+                    headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+
+            await send(start)
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self._app(scope, receive, send_wrapper)
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self._bodies.get(key)
+        if compressed is not None:
+            metrics.increment('compression.cache.hits')
+            return compressed
+
+        metrics.increment('compression.cache.misses')
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=self._brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self._gzip_level, mtime=0)
+        self._bodies.put(key, compressed)
+        return compressed
+
+
+class StaleResponses:
+    """
+    A thread safe LRU of the last successful response to each request, kept to serve when a
+    request has to be shed
+
+    Clearing the responses touches a purge marker file, so that every worker drops the responses
+    it stored before the purge the next time it needs one.
+    """
+
+    def __init__(self, max_entries: int, purge_marker: Optional[Path] = None) -> None:
+        self._max_entries = max_entries
+        self._purge_marker = purge_marker
+        self._lock = threading.Lock()
+        self._responses: OrderedDict[str, Tuple[list, bytes]] = OrderedDict()
+        self._purged_at = self._marker_time()
+
+    def get(self, key: str) -> Optional[Tuple[list, bytes]]:
+        """
+        Get the headers and body of a stored response, if there is one
+        """
+
+        purged_at = self._marker_time()
+        with self._lock:
+            if purged_at > self._purged_at:
+                self._responses.clear()
+                self._purged_at = purged_at
+            return self._responses.get(key)
+
+    def clear(self) -> None:
+        """
+        Drop all stored responses, in this and every other worker
+        """
+
+        if self._purge_marker is not None:
+            self._purge_marker.touch()
+
+        purged_at = self._marker_time()
+        with self._lock:
+            self._responses.clear()
+            self._purged_at = purged_at
+
+    def put(self, key: str, headers: list, body: bytes) -> None:
+        """
+        Store a response's headers and body, evicting the least recently stored if full
+        """
+
+        with self._lock:
+            self._responses[key] = (headers, body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self._max_entries:
+                self._responses.popitem(last=False)
+
+    def _marker_time(self) -> float:
+        if self._purge_marker is None:
+            return 0.0
+        try:
+            return self._purge_marker.stat().st_mtime
+        except OSError:
+            return 0.0
+
+
+@lru_cache
+def stale_responses() -> StaleResponses:
+    """
+    Get and return the stale responses kept to serve shed requests
+    """
+
+    settings = get_settings()
+    return StaleResponses(
+        settings.admission_stale_entries, Path(settings.cache_path) / STALE_PURGE_MARKER
+    )
+
+
+class AdmissionMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    ASGI middleware to limit the requests a worker handles at once and shed load beyond that
+
+    At most max_in_flight requests are handled at once; up to max_queued more wait for a turn
+    for at most queue_timeout seconds. Requests beyond that, or that wait too long, are shed:
+    they get the last successful response to the same request, marked as stale, if there is one
+    and otherwise a fast 503 with Retry-After. Exempt routes are never queued or shed, and
+    requests with credentials are never served a stale response.
+    """
+    def __init__(
+        self,
+        app: FastAPI,
+        *,
+        max_in_flight: int,
+        max_queued: int,
+        queue_timeout: float,
+        retry_after: int,
+        exempt_routes: Optional[List[str]] = None
+    ) -> None:
+        self._app = app
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self._retry_after = retry_after
+        self._stale = stale_responses()
+        self._exempt = tuple(exempt_routes or [])
+        self._in_flight = 0
+        self._queued = 0
+        metrics.gauge('admission.in_flight', lambda: self._in_flight)
+        metrics.gauge('admission.queued', lambda: self._queued)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'].startswith(self._exempt):
+            return await self._app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        key = None
+        if scope['method'] == 'GET' and 'authorization' not in headers:
+            query = scope['query_string'].decode('latin-1')
+            key = f"{scope['path']}?{query}"
+
+        if self._slots.locked():
+            if self._queued >= self._max_queued:
+                metrics.increment('admission.shed.queue_full')
+                return await self._shed(key, scope, receive, send)
+
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self._queue_timeout)
+            except asyncio.TimeoutError:
+                metrics.increment('admission.shed.queue_timeout')
+                return await self._shed(key, scope, receive, send)
+            finally:
+                self._queued -= 1
+        else:
+            await self._slots.acquire()
+
+        self._in_flight += 1
+        try:
+            if key is None:
+                return await self._app(scope, receive, send)
+            return await self._app(scope, receive, self._recording(key, send))
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _recording(self, key: str, send: Send) -> Send:
+        start: Optional[Message] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+            elif start is not None:
+                if start['status'] == HTTPStatus.OK and not message.get('more_body', False):
+                    self._stale.put(key, list(start['headers']), message.get('body', b''))
+                start = None
+
+            await send(message)
+
+        return send_wrapper
+
+    async def _shed(self, key: Optional[str], scope: Scope, receive: Receive, send: Send) -> None:
+        stale = self._stale.get(key) if key else None
+        if stale is not None:
+            metrics.increment('admission.stale')
+            headers, body = stale
+            await send({
+                'type': 'http.response.start',
+                'status': HTTPStatus.OK,
+                'headers': headers + [(b'warning', b'110 - "Response is Stale"')]
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        metrics.increment('admission.shed')
+        response = JSONResponse(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            content={'detail': 'Too many requests, try again later'},
+            headers={'Retry-After': str(self._retry_after)}
+        )
+        await response(scope, receive, send)
+
+
+class UntrustedProxyMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    ASGI middleware to warn, once for each peer, when a peer that isn't one of the trusted_hosts
+    sends X-Forwarded-For
+
+    Forwarded headers from such a peer are ignored, so if it's the reverse proxy every client
+    behind it shares its address and so its client rate limits. A peer whose forwarded address
+    has already been resolved, by a trusted proxy further out, isn't warned about.
+    """
+    def __init__(self, app: FastAPI, *, trusted_hosts: str) -> None:
+        self._app = app
+        self._trusted = {host.strip() for host in trusted_hosts.split(',')}
+        self._warned: Set[str] = set()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http' and '*' not in self._trusted and scope.get('client'):
+            self._check(scope['client'][0], Headers(scope=scope).get('x-forwarded-for'))
+
+        return await self._app(scope, receive, send)
+
+    def _check(self, peer: str, forwarded_for: Optional[str]) -> None:
+        if not forwarded_for or peer in self._trusted or peer in self._warned:
+            return
+
+        if peer in (host.strip() for host in forwarded_for.split(',')):
+            return
+
+        self._warned.add(peer)
+        logger.warning(
+            'Ignoring X-Forwarded-For from %s, which isn\'t in FORWARDED_ALLOW_IPS; if it\'s the '
+            'reverse proxy, every client shares its address and client rate limits',
+            peer
+        )
@@ -4,6 +4,7 @@ Feed Proxy API: common package; .env settings module
 
 from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Optional
 
 import dotenv
 from pydantic import AnyHttpUrl, BaseSettings, EmailStr, HttpUrl
@@ -11,6 +12,53 @@ from pydantic import AnyHttpUrl, BaseSettings, EmailStr, HttpUrl
 DEFAULT_TIMEOUT = 10
 DEFAULT_RETRIES = 5
 DEFAULT_BACKOFF = 0.1
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_KEEPALIVE = '60s'
+DEFAULT_DEADLINE = '15s'
+DEFAULT_RATE_LIMITS = {
+    'musicbrainz.org': 1.0,
+    'api.discogs.com': 1.0,
+    'api.foursquare.com': 2.0
+}
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_SWEEP_INTERVAL = '15m'
+DEFAULT_SWEEP_BATCH = 500
+DEFAULT_VACUUM_PAGES = 1000
+DEFAULT_WEATHER_QUANTISE = 'none'
+DEFAULT_WEATHER_GRID_SIZE = 0.05
+DEFAULT_WEATHER_GEOHASH_PRECISION = 5
+DEFAULT_WEATHER_NEAREST_KM = 0.0
+DEFAULT_WEATHER_BATCH_MAX_POINTS = 50
+DEFAULT_WEATHER_MODE = 'current'
+DEFAULT_WEATHER_FORECAST_EXPIRY = '3h'
+DEFAULT_STORE_PATH = Path('./data-stores/stores')
+DEFAULT_STORE_MAX_LISTENS = 5000
+DEFAULT_LISTENS_SYNC_PAGE = 100
+DEFAULT_LISTENING_STATS = 'local'
+DEFAULT_LISTENING_MAX_COUNT = 50
+DEFAULT_RESPONSE_COMPRESSION_MIN_SIZE = 500
+DEFAULT_RESPONSE_GZIP_LEVEL = 6
+DEFAULT_RESPONSE_BROTLI_QUALITY = 5
+DEFAULT_RESPONSE_COMPRESSION_CACHE_ENTRIES = 256
+DEFAULT_STATIC_MAX_AGE = '1h'
+DEFAULT_ACCESS_LOG_SAMPLE_RATE = 1.0
+DEFAULT_LOOP_MONITOR_INTERVAL = '100ms'
+DEFAULT_LOOP_BLOCKED_THRESHOLD = '250ms'
+DEFAULT_CLIENT_RATE_LIMIT = 1.0
+DEFAULT_CLIENT_RATE_BURST = 30
+DEFAULT_CLIENT_UPSTREAM_COST = 1.0
+DEFAULT_CLIENT_RATE_SYNC = '1s'
+DEFAULT_FORWARDED_ALLOW_IPS = '127.0.0.1'
+DEFAULT_ADMISSION_MAX_IN_FLIGHT = 8
+DEFAULT_ADMISSION_MAX_QUEUED = 32
+DEFAULT_ADMISSION_QUEUE_TIMEOUT = '2s'
+DEFAULT_ADMISSION_RETRY_AFTER = 5
+DEFAULT_ADMISSION_STALE_ENTRIES = 256
+DEFAULT_ACCESS_LOG_QUEUE_SIZE = 10000
+DEFAULT_CDN_WARM_CONCURRENCY = 2
+DEFAULT_CDN_WARM_MAX_PENDING = 100
+DEFAULT_CDN_WARM_EXPIRY = '30d'
 
 
 class Settings(BaseSettings):
@@ -75,9 +123,28 @@ class Settings(BaseSettings):
     default_lng: float
     default_lat: float
 
+    weather_quantise: str = DEFAULT_WEATHER_QUANTISE
+    weather_grid_size: float = DEFAULT_WEATHER_GRID_SIZE
+    weather_geohash_precision: int = DEFAULT_WEATHER_GEOHASH_PRECISION
+    weather_nearest_km: float = DEFAULT_WEATHER_NEAREST_KM
+    weather_batch_max_points: int = DEFAULT_WEATHER_BATCH_MAX_POINTS
+    weather_mode: str = DEFAULT_WEATHER_MODE
+    weather_forecast_expiry: str = DEFAULT_WEATHER_FORECAST_EXPIRY
+
     api_timeout: int = DEFAULT_TIMEOUT
     api_retries: int = DEFAULT_RETRIES
     api_backoff: float = DEFAULT_BACKOFF
+    api_connect_timeout: Optional[float] = None
+    api_read_timeout: Optional[float] = None
+    api_pool_connections: int = DEFAULT_POOL_CONNECTIONS
+    api_pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    api_pool_block: bool = False
+    api_keepalive: Optional[str] = DEFAULT_KEEPALIVE
+    api_deadline: Optional[str] = DEFAULT_DEADLINE
+    api_deadline_checkin: Optional[str] = None
+    api_deadline_listening: Optional[str] = None
+    api_deadline_weather: Optional[str] = None
+    api_rate_limits: Dict[str, float] = DEFAULT_RATE_LIMITS
 
     cache_path: Path
     cache_listens_expiry: str
@@ -92,8 +159,59 @@ class Settings(BaseSettings):
     cache_weather: Path
     cache_checkins_expiry: str
     cache_checkins: Path
+    cache_compression_level: int = DEFAULT_COMPRESSION_LEVEL
+    cache_dictionaries: Optional[Path] = None
+
+    cache_sweep_interval: str = DEFAULT_SWEEP_INTERVAL
+    cache_sweep_batch: int = DEFAULT_SWEEP_BATCH
+    cache_vacuum_pages: int = DEFAULT_VACUUM_PAGES
+    cache_listens_max_size: Optional[str] = None
+    cache_listens_max_entries: Optional[int] = None
+    cache_stats_max_size: Optional[str] = None
+    cache_stats_max_entries: Optional[int] = None
+    cache_images_max_size: Optional[str] = None
+    cache_images_max_entries: Optional[int] = None
+    cache_artists_max_size: Optional[str] = None
+    cache_artists_max_entries: Optional[int] = None
+    cache_weather_max_size: Optional[str] = None
+    cache_weather_max_entries: Optional[int] = None
+    cache_checkins_max_size: Optional[str] = None
+    cache_checkins_max_entries: Optional[int] = None
+
+    store_path: Path = DEFAULT_STORE_PATH
+    store_max_listens: int = DEFAULT_STORE_MAX_LISTENS
+    listens_sync_page: int = DEFAULT_LISTENS_SYNC_PAGE
+    listening_stats: str = DEFAULT_LISTENING_STATS
+    listening_max_count: int = DEFAULT_LISTENING_MAX_COUNT
+
+    admin_token: Optional[str] = None
+
+    access_log_sample_rate: float = DEFAULT_ACCESS_LOG_SAMPLE_RATE
+    access_log_queue_size: int = DEFAULT_ACCESS_LOG_QUEUE_SIZE
+
+    admission_max_in_flight: int = DEFAULT_ADMISSION_MAX_IN_FLIGHT
+    admission_max_queued: int = DEFAULT_ADMISSION_MAX_QUEUED
+    admission_queue_timeout: str = DEFAULT_ADMISSION_QUEUE_TIMEOUT
+    admission_retry_after: int = DEFAULT_ADMISSION_RETRY_AFTER
+    admission_stale_entries: int = DEFAULT_ADMISSION_STALE_ENTRIES
+
+    client_rate_limit: float = DEFAULT_CLIENT_RATE_LIMIT
+    client_rate_burst: int = DEFAULT_CLIENT_RATE_BURST
+    client_upstream_cost: float = DEFAULT_CLIENT_UPSTREAM_COST
+    client_rate_sync: str = DEFAULT_CLIENT_RATE_SYNC
+    forwarded_allow_ips: str = DEFAULT_FORWARDED_ALLOW_IPS
+
+    loop_monitor: bool = True
+    loop_monitor_interval: str = DEFAULT_LOOP_MONITOR_INTERVAL
+    loop_blocked_threshold: str = DEFAULT_LOOP_BLOCKED_THRESHOLD
+
+    response_compression_min_size: int = DEFAULT_RESPONSE_COMPRESSION_MIN_SIZE
+    response_gzip_level: int = DEFAULT_RESPONSE_GZIP_LEVEL
+    response_brotli_quality: int = DEFAULT_RESPONSE_BROTLI_QUALITY
+    response_compression_cache_entries: int = DEFAULT_RESPONSE_COMPRESSION_CACHE_ENTRIES
 
     static_path: Path
+    static_max_age: str = DEFAULT_STATIC_MAX_AGE
     cdn_base_url: HttpUrl
     cdn_path: Path
     cdn_secret: str
@@ -101,6 +219,10 @@ class Settings(BaseSettings):
     cdn_hash_size: int
     cdn_image_height: int
     cdn_image_width: int
+    cdn_warm: bool = True
+    cdn_warm_concurrency: int = DEFAULT_CDN_WARM_CONCURRENCY
+    cdn_warm_max_pending: int = DEFAULT_CDN_WARM_MAX_PENDING
+    cdn_warm_expiry: str = DEFAULT_CDN_WARM_EXPIRY
 
     feed_api_version: str
 
@@ -0,0 +1,182 @@
+"""
+Feed Proxy API: common package; in-memory static assets module
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+import gzip
+import hashlib
+from http import HTTPStatus
+import logging
+import mimetypes
+from pathlib import Path
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import humanfriendly
+from starlette.datastructures import Headers, QueryParams
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from feed_proxy.common.middleware import COMPRESSIBLE_TYPES, brotli, negotiate_encoding
+from feed_proxy.common.settings import get_settings
+
+IDENTITY = 'identity'
+VERSION_SIZE = 12
+MAX_ASSET_SIZE = 1024 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+logger = logging.getLogger('gunicorn.error')
+
+
+@dataclass
+class StaticAsset:
+    """
+    A static file held in memory, with its content hash version and a body for each encoding
+    """
+
+    content_type: str
+    version: str
+    bodies: Dict[str, bytes]
+
+    def etag(self, encoding: str) -> str:
+        """
+        Get the strong ETag of one encoding of the asset
+        """
+
+        return f'"{self.version}"' if encoding == IDENTITY else f'"{self.version}-{encoding}"'
+
+
+def load_asset(path: Path) -> StaticAsset:
+    """
+    Read a static file and precompress it, keeping only the encodings that are smaller
+    """
+
+    body = path.read_bytes()
+    content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    bodies = {IDENTITY: body}
+    if content_type.startswith(COMPRESSIBLE_TYPES):
+        variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+        bodies.update({
+            encoding: compressed
+            for encoding, compressed in variants.items()
+            if len(compressed) < len(body)
+        })
+
+    return StaticAsset(
+        content_type=content_type,
+        version=hashlib.sha256(body).hexdigest()[:VERSION_SIZE],
+        bodies=bodies
+    )
+
+
+class StaticAssets:
+    """
+    An ASGI app serving the static directory from memory, loaded on first use
+
+    Each file is served with precompressed gzip and brotli variants and strong ETags; requests
+    for a file's content hashed URL (with a matching ?v= version) are marked as immutable. Files
+    that aren't held in memory, such as those added since loading or larger than MAX_ASSET_SIZE,
+    are served from disk.
+    """
+
+    def __init__(self, directory: Path, max_age: int) -> None:
+        self._directory = directory
+        self._max_age = max_age
+        self._fallback = StaticFiles(directory=directory)
+        self._lock = threading.Lock()
+        self._assets: Optional[Dict[str, StaticAsset]] = None
+
+    def assets(self) -> Dict[str, StaticAsset]:
+        """
+        Get the in-memory assets, keyed by path relative to the static directory, loading them on
+        first use
+        """
+
+        if self._assets is None:
+            with self._lock:
+                if self._assets is None:
+                    self._assets = self._load()
+
+        return self._assets
+
+    def version(self, path: str) -> Optional[str]:
+        """
+        Get the content hash version of a static file, if it's held in memory
+        """
+
+        asset = self.assets().get(path.lstrip('/'))
+        return asset.version if asset else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        asset = self.assets().get(scope['path'].lstrip('/'))
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD') or asset is None:
+            return await self._fallback(scope, receive, send)
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get('accept-encoding', ''))
+        if encoding not in asset.bodies:
+            encoding = IDENTITY
+        body = asset.bodies[encoding]
+        etag = asset.etag(encoding)
+
+        immutable = QueryParams(scope['query_string']).get('v') == asset.version
+        cache_control = (
+            f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+            if immutable else f'public, max-age={self._max_age}'
+        )
+        headers: List[Tuple[bytes, bytes]] = [
+            (b'etag', etag.encode()),
+            (b'cache-control', cache_control.encode()),
+            (b'vary', b'Accept-Encoding'),
+        ]
+
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in if_none_match):
+            await send({
+                'type': 'http.response.start', 'status': HTTPStatus.NOT_MODIFIED, 'headers': headers
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return None
+
+        headers.append((b'content-type', asset.content_type.encode()))
+        headers.append((b'content-length', str(len(body)).encode()))
+        if encoding != IDENTITY:
+            headers.append((b'content-encoding', encoding.encode()))
+
+        await send({'type': 'http.response.start', 'status': HTTPStatus.OK, 'headers': headers})
+        await send({
+            'type': 'http.response.body', 'body': body if scope['method'] == 'GET' else b''
+        })
+        return None
+
+    def _load(self) -> Dict[str, StaticAsset]:
+        assets = {}
+        for path in sorted(self._directory.rglob('*')):
+            relative = path.relative_to(self._directory)
+            if not path.is_file() or any(part.startswith('.') for part in relative.parts):
+                continue
+            if path.stat().st_size > MAX_ASSET_SIZE:
+                continue
+            assets[relative.as_posix()] = load_asset(path)
+
+        logger.info(
+            'Loaded %s static assets (%s)',
+            len(assets),
+            humanfriendly.format_size(sum(len(asset.bodies[IDENTITY]) for asset in assets.values()))
+        )
+        return assets
+
+
+@lru_cache
+def static_assets() -> StaticAssets:
+    """
+    Get and return the in-memory static assets app
+    """
+
+    settings = get_settings()
+    return StaticAssets(
+        settings.static_path, int(humanfriendly.parse_timespan(settings.static_max_age))
+    )
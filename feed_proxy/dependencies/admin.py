@@ -0,0 +1,35 @@
+"""
+Feed Proxy API: dependencies package; admin authentication module
+"""
+
+from http import HTTPStatus
+import hmac
+from typing import Optional
+
+from fastapi import Depends
+from fastapi.exceptions import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from feed_proxy.common.settings import get_settings
+
+bearer = HTTPBearer(auto_error=False)
+
+
+def admin_auth(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)) -> None:
+    """
+    Check the request carries the admin bearer token; the admin routes don't exist unless an
+    admin token has been configured
+    """
+
+    settings = get_settings()
+    if not settings.admin_token:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='Not Found')
+
+    if not credentials or not hmac.compare_digest(
+        credentials.credentials.encode(), settings.admin_token.encode()
+    ):
+        raise HTTPException(
+            status_code=HTTPStatus.UNAUTHORIZED,
+            detail='Invalid or missing admin token',
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
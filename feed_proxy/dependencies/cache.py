@@ -3,20 +3,27 @@ Feed Proxy API: dependencies package; cache module
 """
 
 import base64
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import datetime
 from functools import lru_cache
 import hashlib
 import hmac
+import os
+from pathlib import Path
+from typing import Callable, Dict, cast
 
 import humanfriendly
-from requests.adapters import HTTPAdapter
+from requests import Response
 from requests_cache import CachedSession, SQLiteCache
+from requests_cache.models.response import BaseResponse
 from starlette.datastructures import URL
-from urllib3.util.retry import Retry
 
+from feed_proxy.common.metrics import metrics
 from feed_proxy.common.settings import get_settings
 from feed_proxy.common.version import user_agent
+from feed_proxy.dependencies.maintenance import access_recorder
+from feed_proxy.dependencies.serializers import compact_serializer
+from feed_proxy.dependencies.upstream import upstream_adapter
 
 
 @dataclass
@@ -32,98 +39,173 @@ class SessionCaches:
     weather: CachedSession
     checkins: CachedSession
 
+    def categories(self) -> Dict[str, CachedSession]:
+        """
+        Get the cached sessions by category name
+        """
 
-STATUSES = [500, 502, 503, 504]
-
-DEFAULT_HEADERS = {
-    'Accept': 'application/json',
-    'User-Agent': user_agent()
-}
-
-settings = get_settings()
-retries = Retry(
-    total=settings.api_retries,
-    backoff_factor=settings.api_backoff,
-    status_forcelist=STATUSES
-)
-listens = CachedSession(
-    settings.cache_listens.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_listens.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(
-            seconds=humanfriendly.parse_timespan(settings.cache_listens_expiry)
-        )
-    },
-    headers=DEFAULT_HEADERS
-)
-listens.mount('https://', HTTPAdapter(max_retries=retries))
-
-stats = CachedSession(
-    settings.cache_stats.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_stats.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(seconds=humanfriendly.parse_timespan(settings.cache_stats_expiry))
-    },
-    headers=DEFAULT_HEADERS
-)
-stats.mount('https://', HTTPAdapter(max_retries=retries))
-
-images = CachedSession(
-    settings.cache_images.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_images.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(seconds=humanfriendly.parse_timespan(settings.cache_images_expiry))
-    },
-    headers=DEFAULT_HEADERS
-)
-images.mount('https://', HTTPAdapter(max_retries=retries))
-
-artists = CachedSession(
-    settings.cache_artists.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_artists.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(
-            seconds=humanfriendly.parse_timespan(settings.cache_artists_expiry)
-        )
-    },
-    headers=DEFAULT_HEADERS
-)
-artists.mount('https://', HTTPAdapter(max_retries=retries))
-
-weather = CachedSession(
-    settings.cache_weather.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_weather.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(
-            seconds=humanfriendly.parse_timespan(settings.cache_weather_expiry)
-        )
-    },
-    headers=DEFAULT_HEADERS
-)
-weather.mount('https://', HTTPAdapter(max_retries=retries))
-
-checkins = CachedSession(
-    settings.cache_checkins.as_posix(),
-    backend=SQLiteCache(db_path=settings.cache_checkins.absolute()),
-    urls_expire_after={
-        '*': datetime.timedelta(
-            seconds=humanfriendly.parse_timespan(settings.cache_checkins_expiry)
-        )
-    },
-    headers=DEFAULT_HEADERS
-)
-checkins.mount('https://', HTTPAdapter(max_retries=retries))
-
-caches = SessionCaches(listens, stats, images, artists, weather, checkins)
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+    def databases(self) -> Dict[str, Path]:
+        """
+        Get the cache database paths by category name
+        """
+
+        return {
+            category: Path(sqlite_cache(session).db_path)
+            for category, session in self.categories().items()
+        }
+
+
+def sqlite_cache(session: CachedSession) -> SQLiteCache:
+    """
+    Get a cached session's cache backend; all the sessions are built with SQLite caches
+    """
+
+    return cast(SQLiteCache, session.cache)
+
+
+def cache_metrics_hook(category: str) -> Callable[..., None]:
+    """
+    Build a requests response hook that counts cache hits and misses for a cache category
+    """
+
+    def _count_response(response: Response, *_args, **_kwargs) -> None:
+        # Session hooks also run on the raw response inside requests' own send(), before
+        # requests_cache wraps it; only count the wrapped response
+        if not isinstance(response, BaseResponse):
+            return
+
+        # only_if_cached misses come back as a synthetic 504 cached response with no cache key
+        if response.from_cache and not response.cache_key:
+            metrics.increment(f'cache.{category}.misses')
+            return
+
+        if response.from_cache:
+            metrics.increment(f'cache.{category}.hits')
+        else:
+            metrics.increment(f'cache.{category}.misses')
+
+    return _count_response
+
+
+def build_sessions() -> SessionCaches:
+    """
+    Build the cached sessions, opening their cache databases
+    """
+
+    settings = get_settings()
+    headers = {
+        'Accept': 'application/json',
+        'User-Agent': user_agent()
+    }
+    adapter = upstream_adapter()
+
+    listens = CachedSession(
+        settings.cache_listens.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_listens.absolute(),
+            serializer=compact_serializer('listens')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_listens_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    stats = CachedSession(
+        settings.cache_stats.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_stats.absolute(),
+            serializer=compact_serializer('stats')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_stats_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    images = CachedSession(
+        settings.cache_images.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_images.absolute(),
+            serializer=compact_serializer('images')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_images_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    artists = CachedSession(
+        settings.cache_artists.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_artists.absolute(),
+            serializer=compact_serializer('artists')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_artists_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    weather = CachedSession(
+        settings.cache_weather.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_weather.absolute(),
+            serializer=compact_serializer('weather')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_weather_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    checkins = CachedSession(
+        settings.cache_checkins.as_posix(),
+        backend=SQLiteCache(
+            db_path=settings.cache_checkins.absolute(),
+            serializer=compact_serializer('checkins')
+        ),
+        urls_expire_after={
+            '*': datetime.timedelta(
+                seconds=humanfriendly.parse_timespan(settings.cache_checkins_expiry)
+            )
+        },
+        headers=headers
+    )
+
+    caches = SessionCaches(listens, stats, images, artists, weather, checkins)
+    for name, session in caches.categories().items():
+        session.mount('https://', adapter)
+        session.hooks['response'].append(access_recorder.hook(name))
+        session.hooks['response'].append(cache_metrics_hook(name))
+
+    return caches
 
 
 @lru_cache
 def sessions() -> SessionCaches:
     """
-    Get and return the cached sessions
+    Get and return the cached sessions, building them on first use
     """
 
-    return caches
+    return build_sessions()
+
+
+# Sessions hold SQLite connections and pooled sockets that mustn't be shared with a forked worker,
+# so a worker forked from a preloaded master builds its own
+os.register_at_fork(after_in_child=sessions.cache_clear)
 
 
 def signed_cdn_url(url: URL) -> URL:
@@ -131,6 +213,7 @@ def signed_cdn_url(url: URL) -> URL:
     Format and sign an image CDN URL
     """
 
+    settings = get_settings()
     key = bytes(settings.cdn_secret, 'ascii')
     path = f'{settings.cdn_image_height}x{settings.cdn_image_width}/{str(url)}'
     raw = bytes(bytes(path, 'ascii'))
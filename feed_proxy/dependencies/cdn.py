@@ -0,0 +1,172 @@
+"""
+Feed Proxy API: dependencies package; image CDN warm-up module
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+
+import humanfriendly
+import requests
+from starlette.datastructures import URL
+
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+from feed_proxy.common.version import user_agent
+from feed_proxy.dependencies.stores import SQLiteStore
+
+WARM_CHUNK_SIZE = 64 * 1024
+MAX_REMEMBERED = 10000
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class WarmStore(SQLiteStore):
+    """
+    The signed CDN URLs already warmed, and when, shared by all the workers
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS warm_urls (
+            url TEXT PRIMARY KEY,
+            warmed_at INTEGER NOT NULL
+        );
+    """
+
+    def warmed_at(self, url: str) -> Optional[float]:
+        """
+        Get when a URL was last warmed, if it has been
+        """
+
+        with self.connection() as con:
+            row = con.execute('SELECT warmed_at FROM warm_urls WHERE url = ?', (url, )).fetchone()
+
+        return row[0] if row else None
+
+    def mark_warm(self, url: str) -> None:
+        """
+        Record that a URL has just been warmed
+        """
+
+        with self.connection() as con:
+            con.execute(
+                'INSERT OR REPLACE INTO warm_urls (url, warmed_at) VALUES (?, ?)',
+                (url, int(time.time()))
+            )
+
+    def prune(self, before: float) -> int:
+        """
+        Forget URLs warmed before a timestamp, returning how many were forgotten
+        """
+
+        with self.connection() as con:
+            return con.execute('DELETE FROM warm_urls WHERE warmed_at < ?', (before, )).rowcount
+
+
+class CdnWarmer:    # pylint: disable=too-few-public-methods
+    """
+    Requests newly seen signed CDN image URLs in the background, so the CDN has resized and stored
+    each image before a browser first asks for it
+
+    At most max_pending URLs are queued or being fetched at once; any more are dropped and warmed
+    the next time they're seen. A URL is warmed again once expiry seconds have passed since it
+    was last warmed.
+    """
+
+    def __init__(self, store: WarmStore, concurrency: int, max_pending: int, expiry: float) -> None:
+        self._store = store
+        self._max_pending = max_pending
+        self._expiry = expiry
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cdn-warmer')
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = user_agent()
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._warm: Dict[str, float] = {}
+
+    def warm(self, url: URL) -> None:
+        """
+        Queue a signed CDN URL to be warmed, unless it's already warm or queued
+        """
+
+        key = str(url)
+        with self._lock:
+            if self._warm.get(key, 0.0) > time.time() - self._expiry or key in self._pending:
+                return
+            if len(self._pending) >= self._max_pending:
+                metrics.increment('cdn.warm.dropped')
+                return
+            self._pending.add(key)
+
+        metrics.increment('cdn.warm.queued')
+        self._executor.submit(self._fetch, key)
+
+    def _fetch(self, url: str) -> None:
+        settings = get_settings()
+        warmed_at = None
+        try:
+            stored = self._store.warmed_at(url)
+            if stored is not None and stored >= time.time() - self._expiry:
+                warmed_at = stored
+                return
+
+            with self._session.get(url, stream=True, timeout=settings.api_timeout) as rsp:
+                for _chunk in rsp.iter_content(WARM_CHUNK_SIZE):
+                    pass
+
+            if rsp.ok:
+                self._store.mark_warm(url)
+                metrics.increment('cdn.warm.warmed')
+                warmed_at = time.time()
+            else:
+                logger.warning('Failed to warm %s: %s', url, rsp.status_code)
+                metrics.increment('cdn.warm.failed')
+
+        except Exception as exc:    # pylint: disable=broad-except
+            logger.warning('Failed to warm %s: %r', url, exc)
+            metrics.increment('cdn.warm.failed')
+
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+                if warmed_at is not None:
+                    self._remember(url, warmed_at)
+
+    def _remember(self, url: str, warmed_at: float) -> None:
+        now = time.time()
+        if len(self._warm) >= MAX_REMEMBERED:
+            self._warm = {
+                key: remembered
+                for key, remembered in self._warm.items() if remembered > now - self._expiry
+            }
+            if len(self._warm) >= MAX_REMEMBERED:
+                self._warm.clear()
+        self._warm[url] = warmed_at
+
+
+@lru_cache
+def cdn_warmer() -> Optional[CdnWarmer]:
+    """
+    Get and return the CDN warmer, starting it on first use, or None if warming is turned off
+    """
+
+    settings = get_settings()
+    if not settings.cdn_warm:
+        return None
+
+    expiry = humanfriendly.parse_timespan(settings.cdn_warm_expiry)
+    store = WarmStore(settings.store_path / 'cdn.sqlite')
+    store.prune(time.time() - expiry)
+    return CdnWarmer(
+        store,
+        concurrency=settings.cdn_warm_concurrency,
+        max_pending=settings.cdn_warm_max_pending,
+        expiry=expiry
+    )
+
+
+os.register_at_fork(after_in_child=cdn_warmer.cache_clear)
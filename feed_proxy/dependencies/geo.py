@@ -0,0 +1,147 @@
+"""
+Feed Proxy API: dependencies package; geo-quantised weather index module
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import humanfriendly
+
+from feed_proxy.common.geo import KM_PER_DEGREE, geohash_decode, geohash_encode, haversine, snap_to_grid
+from feed_proxy.common.settings import get_settings
+
+QUANTISE_NONE = 'none'
+QUANTISE_GRID = 'grid'
+QUANTISE_GEOHASH = 'geohash'
+
+MAX_INDEX_ENTRIES = 4096
+
+
+def quantise(lat: float, lng: float) -> Tuple[float, float]:
+    """
+    Quantise a point according to the configured weather quantisation mode, so nearby points share
+    a single upstream request and cache entry
+    """
+
+    settings = get_settings()
+    mode = settings.weather_quantise.lower()
+    if mode == QUANTISE_GRID:
+        return snap_to_grid(lat, lng, settings.weather_grid_size)
+
+    if mode == QUANTISE_GEOHASH:
+        center_lat, center_lng = geohash_decode(
+            geohash_encode(lat, lng, settings.weather_geohash_precision)
+        )
+        return round(center_lat, 6), round(center_lng, 6)
+
+    return lat, lng
+
+
+@dataclass
+class IndexEntry:
+    """
+    A single indexed weather observation
+    """
+
+    lat: float
+    lng: float
+    expires: float
+    value: dict
+
+
+class WeatherIndex:
+    """
+    An in-memory spatial index of fresh weather observations
+
+    Observations are bucketed into cells roughly radius km across, so finding the nearest fresh
+    observation within radius km only has to look at the neighbouring cells.
+    """
+
+    def __init__(self, radius: float, expiry: float) -> None:
+        self._radius = radius
+        self._expiry = expiry
+        self._cell_size = max(radius / KM_PER_DEGREE, 1e-6)
+        self._lock = threading.Lock()
+        self._cells: Dict[Tuple[int, int], List[IndexEntry]] = {}
+        self._entries = 0
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self._cell_size), math.floor(lng / self._cell_size)
+
+    def add(self, lat: float, lng: float, value: dict, expires: Optional[float] = None) -> None:
+        """
+        Index a weather observation for a point
+        """
+
+        now = time.time()
+        entry = IndexEntry(lat, lng, expires or now + self._expiry, value)
+        with self._lock:
+            if self._entries >= MAX_INDEX_ENTRIES:
+                self._prune(now)
+            cell = self._cells.setdefault(self._cell(lat, lng), [])
+            before = len(cell)
+            cell[:] = [existing for existing in cell if (existing.lat, existing.lng) != (lat, lng)]
+            cell.append(entry)
+            self._entries += len(cell) - before
+
+    def nearest(self, lat: float, lng: float) -> Optional[dict]:
+        """
+        Find the nearest fresh observation within the index radius of a point, if there is one; with
+        a zero radius only an observation for exactly the same point matches
+        """
+
+        now = time.time()
+        row, col = self._cell(lat, lng)
+        # A degree of longitude shrinks with latitude, so more columns are needed away from the
+        # equator to cover the same distance
+        cols = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+
+        best: Optional[IndexEntry] = None
+        best_distance = self._radius
+        with self._lock:
+            for d_row in (-1, 0, 1):
+                for d_col in range(-cols, cols + 1):
+                    for entry in self._cells.get((row + d_row, col + d_col), []):
+                        if entry.expires <= now:
+                            continue
+                        distance = haversine(lat, lng, entry.lat, entry.lng)
+                        if distance <= best_distance:
+                            best = entry
+                            best_distance = distance
+
+        return best.value if best else None
+
+    def _prune(self, now: float) -> None:
+        for key in list(self._cells):
+            fresh = [entry for entry in self._cells[key] if entry.expires > now]
+            if fresh:
+                self._cells[key] = fresh
+            else:
+                del self._cells[key]
+
+        self._entries = sum(len(entries) for entries in self._cells.values())
+        if self._entries >= MAX_INDEX_ENTRIES:
+            self._cells.clear()
+            self._entries = 0
+
+
+@lru_cache
+def weather_index() -> WeatherIndex:
+    """
+    Get and return this worker's weather index, building it on first use
+    """
+
+    settings = get_settings()
+    return WeatherIndex(
+        radius=settings.weather_nearest_km,
+        expiry=humanfriendly.parse_timespan(settings.cache_weather_expiry)
+    )
+
+
+# The index's lock mustn't be shared with a forked worker, so each worker builds its own
+os.register_at_fork(after_in_child=weather_index.cache_clear)
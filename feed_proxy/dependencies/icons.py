@@ -0,0 +1,80 @@
+"""
+Feed Proxy API: dependencies package; static icons module
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+from fastapi import Request
+
+from feed_proxy.common.static import static_assets
+from feed_proxy.common.weather_codes import WEATHER_CODES
+
+MUSIC_ICON = '/heroicons/24/solid/musical-note.svg'
+WEATHER_ICON = '/weather-icons/fill/svg/{icon}.svg'
+DAY_NIGHT = ('day', 'night')
+MAX_BASE_URLS = 16
+
+
+@dataclass
+class StaticIcons:
+    """
+    Precomputed static icon URLs for a single API base URL
+    """
+
+    music: str
+    weather: Dict[Tuple[int, str], str]
+
+
+# Static icon paths, relative to the static mount, for every weather code and day/night
+# combination plus the placeholder icons; these only need prefixing with a base URL
+WEATHER_ICON_PATHS = {
+    (code, day_night): WEATHER_ICON.format(icon=details['icon'].format(day_night=day_night))
+    for code, details in WEATHER_CODES.items()
+    for day_night in DAY_NIGHT
+}
+
+_icons: Dict[str, StaticIcons] = {}
+
+
+def static_url_for(static_url: str, path: str) -> str:
+    """
+    Build the URL of a static icon, content hashed with its version so it can be cached forever
+    """
+
+    version = static_assets().version(path)
+    return f'{static_url}{path}?v={version}' if version else f'{static_url}{path}'
+
+
+def build_static_icons(static_url: str) -> StaticIcons:
+    """
+    Build the static icon URL table for a static mount URL
+    """
+
+    static_url = static_url.rstrip('/')
+    return StaticIcons(
+        music=static_url_for(static_url, MUSIC_ICON),
+        weather={
+            key: static_url_for(static_url, path)
+            for key, path in WEATHER_ICON_PATHS.items()
+        }
+    )
+
+
+def static_icons(request: Request) -> StaticIcons:
+    """
+    Get and return the static icon URLs for the request's base URL
+
+    The base URL can vary per request (ProxyHeadersMiddleware can rewrite the scheme) so the route
+    reversal for the static mount is done once per base URL and then cached.
+    """
+
+    base_url = str(request.base_url)
+    icons = _icons.get(base_url)
+    if icons is None:
+        if len(_icons) >= MAX_BASE_URLS:
+            _icons.clear()
+        icons = build_static_icons(str(request.url_for('static', path='')))
+        _icons[base_url] = icons
+
+    return icons
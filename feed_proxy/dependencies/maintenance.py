@@ -0,0 +1,340 @@
+"""
+Feed Proxy API: dependencies package; cache maintenance module
+"""
+
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass
+import fcntl
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import humanfriendly
+from requests import Response
+
+from feed_proxy.common.settings import get_settings
+
+logger = logging.getLogger('gunicorn.error')
+
+REPORT_FILE = 'maintenance.json'
+LOCK_FILE = '.maintenance.lock'
+TABLE = 'responses'
+SQLITE_TIMEOUT = 30.0
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+@dataclass
+class CacheLimits:
+    """
+    Size and entry count limits for a single cache category
+    """
+
+    max_size: Optional[int] = None
+    max_entries: Optional[int] = None
+
+
+@dataclass
+class SweepReport:    # pylint: disable=too-many-instance-attributes
+    """
+    The outcome of sweeping a single cache category
+    """
+
+    category: str
+    entries: int = 0
+    size: int = 0
+    file_size: int = 0
+    touched: int = 0
+    expired: int = 0
+    evicted: int = 0
+    vacuumed_pages: int = 0
+    elapsed: float = 0.0
+
+
+class AccessRecorder:
+    """
+    Record when cached responses are used, so the sweeper can evict least recently used entries
+
+    Accesses are buffered in memory and written back in a single batch per sweep, so cache hits
+    never turn into SQLite writes on the request path.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, Dict[str, int]] = {}
+
+    def hook(self, category: str) -> Callable[..., None]:
+        """
+        Build a requests response hook that records accesses for a cache category
+        """
+
+        def _record_access(response: Response, *_args, **_kwargs) -> None:
+            cache_key = getattr(response, 'cache_key', None)
+            if cache_key:
+                with self._lock:
+                    self._accessed.setdefault(category, {})[cache_key] = int(time.time())
+
+        return _record_access
+
+    def drain(self, category: str) -> Dict[str, int]:
+        """
+        Remove and return the buffered accesses for a cache category
+        """
+
+        with self._lock:
+            return self._accessed.pop(category, {})
+
+
+def cache_limits(category: str) -> CacheLimits:
+    """
+    Get the configured limits for a cache category
+    """
+
+    settings = get_settings()
+    max_size = getattr(settings, f'cache_{category}_max_size', None)
+    return CacheLimits(
+        max_size=humanfriendly.parse_size(max_size) if max_size else None,
+        max_entries=getattr(settings, f'cache_{category}_max_entries', None)
+    )
+
+
+@contextmanager
+def _connect(db_path: Path) -> Iterator[sqlite3.Connection]:
+    with closing(sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT, isolation_level=None)) as con:
+        yield con
+
+
+def prepare_database(db_path: Path) -> None:
+    """
+    Add the access time column, index and insert trigger that LRU eviction relies on to a cache
+    database, if it doesn't have them yet
+    """
+
+    with _connect(db_path) as con:
+        columns = {row[1] for row in con.execute(f'PRAGMA table_info({TABLE})')}
+        if 'accessed' in columns:
+            return
+
+        con.execute('BEGIN IMMEDIATE')
+        # Another worker may have got here first, while this one waited for the lock
+        columns = {row[1] for row in con.execute(f'PRAGMA table_info({TABLE})')}
+        if 'accessed' not in columns:
+            con.execute(f'ALTER TABLE {TABLE} ADD COLUMN accessed INTEGER')
+            con.execute(f'CREATE INDEX IF NOT EXISTS accessed_idx ON {TABLE}(accessed)')
+            # Responses are written by requests-cache without an access time; stamp them as
+            # accessed when written, so new entries from other workers aren't the first to be
+            # evicted before their access times are recorded
+            con.execute(
+                f'CREATE TRIGGER IF NOT EXISTS accessed_on_insert AFTER INSERT ON {TABLE} '
+                f'WHEN NEW.accessed IS NULL BEGIN '
+                f"UPDATE {TABLE} SET accessed = CAST(strftime('%s', 'now') AS INTEGER) "
+                f'WHERE key = NEW.key; END'
+            )
+            con.execute(f'UPDATE {TABLE} SET accessed = ?', (int(time.time()),))
+        con.execute('COMMIT')
+
+
+def _delete_batches(con: sqlite3.Connection, where: str, params: tuple, batch: int) -> int:
+    deleted = 0
+    while True:
+        cur = con.execute(
+            f'DELETE FROM {TABLE} WHERE key IN (SELECT key FROM {TABLE} WHERE {where} LIMIT ?)',
+            params + (batch,)
+        )
+        deleted += cur.rowcount
+        if cur.rowcount < batch:
+            return deleted
+
+
+def _evict(con: sqlite3.Connection, limits: CacheLimits, batch: int) -> int:
+    evicted = 0
+
+    if limits.max_entries is not None:
+        (entries,) = con.execute(f'SELECT COUNT(key) FROM {TABLE}').fetchone()
+        excess = entries - limits.max_entries
+        while excess > 0:
+            cur = con.execute(
+                f'DELETE FROM {TABLE} WHERE key IN ('
+                f'    SELECT key FROM {TABLE} ORDER BY accessed LIMIT ?'
+                ')', (min(excess, batch),)
+            )
+            if not cur.rowcount:
+                break
+            evicted += cur.rowcount
+            excess -= cur.rowcount
+
+    if limits.max_size is not None:
+        (size,) = con.execute(f'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {TABLE}').fetchone()
+        while size > limits.max_size:
+            rows = con.execute(
+                f'SELECT key, LENGTH(value) FROM {TABLE} ORDER BY accessed LIMIT ?',
+                (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            victims: List[str] = []
+            for key, length in rows:
+                victims.append(key)
+                size -= length or 0
+                if size <= limits.max_size:
+                    break
+            con.executemany(f'DELETE FROM {TABLE} WHERE key = ?', [(key,) for key in victims])
+            evicted += len(victims)
+
+    return evicted
+
+
+def _vacuum(con: sqlite3.Connection, pages: int) -> int:
+    if pages <= 0:
+        return 0
+
+    (auto_vacuum,) = con.execute('PRAGMA auto_vacuum').fetchone()
+    (free_pages,) = con.execute('PRAGMA freelist_count').fetchone()
+    if auto_vacuum != AUTO_VACUUM_INCREMENTAL:
+        # A one-off full VACUUM is needed to switch an existing database to incremental vacuuming
+        con.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        con.execute('VACUUM')
+        return free_pages
+
+    if free_pages:
+        con.execute(f'PRAGMA incremental_vacuum({pages})')
+
+    return min(free_pages, pages)
+
+
+def sweep_category(
+    category: str,
+    db_path: Path,
+    accessed: Dict[str, int],
+    sweep: bool = True,
+) -> SweepReport:
+    """
+    Write back buffered accesses for a cache category and, if sweep is set, delete expired
+    responses, evict least recently used responses beyond the category's limits and incrementally
+    vacuum the database
+    """
+
+    settings = get_settings()
+    report = SweepReport(category=category)
+    start_time = time.perf_counter()
+    batch = settings.cache_sweep_batch
+
+    with _connect(db_path) as con:
+        if accessed:
+            con.execute('BEGIN IMMEDIATE')
+            con.executemany(
+                f'UPDATE {TABLE} SET accessed = ? WHERE key = ?',
+                [(timestamp, key) for key, timestamp in accessed.items()]
+            )
+            con.execute('COMMIT')
+            report.touched = len(accessed)
+
+        if sweep:
+            report.expired = _delete_batches(con, 'expires <= ?', (round(time.time()),), batch)
+            report.evicted = _evict(con, cache_limits(category), batch)
+            con.execute(f'DELETE FROM redirects WHERE value NOT IN (SELECT key FROM {TABLE})')
+            report.vacuumed_pages = _vacuum(con, settings.cache_vacuum_pages)
+
+        report.entries, report.size = con.execute(
+            f'SELECT COUNT(key), COALESCE(SUM(LENGTH(value)), 0) FROM {TABLE}'
+        ).fetchone()
+
+    report.file_size = db_path.stat().st_size if db_path.exists() else 0
+    report.elapsed = round(time.perf_counter() - start_time, 4)
+    return report
+
+
+def read_report() -> dict:
+    """
+    Read the most recent maintenance report written by any worker
+    """
+
+    settings = get_settings()
+    path = Path(settings.cache_path) / REPORT_FILE
+    try:
+        return json.loads(path.read_text(encoding='UTF-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+class CacheSweeper(threading.Thread):
+    """
+    Background cache maintenance thread
+
+    Every worker writes back its own buffered accesses each interval; a file lock and the
+    timestamp of the last report ensure only one worker per interval does the expiry, eviction and
+    vacuuming, however many gunicorn workers are running.
+    """
+
+    def __init__(self, databases: Dict[str, Path], recorder: AccessRecorder) -> None:
+        super().__init__(name='cache-sweeper', daemon=True)
+        settings = get_settings()
+        self._databases = databases
+        self._recorder = recorder
+        self._interval = humanfriendly.parse_timespan(settings.cache_sweep_interval)
+        self._lock_path = Path(settings.cache_path) / LOCK_FILE
+        self._report_path = Path(settings.cache_path) / REPORT_FILE
+        self._stopped = threading.Event()
+        for db_path in databases.values():
+            prepare_database(db_path)
+
+    def stop(self) -> None:
+        """
+        Stop the sweeper at the end of its current pass
+        """
+
+        self._stopped.set()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                self.sweep()
+            except Exception:    # pylint: disable=broad-except
+                logger.exception('Cache maintenance failed')
+
+    def sweep(self, force: bool = False) -> Dict[str, dict]:
+        """
+        Run a single maintenance pass over all cache categories
+        """
+
+        with open(self._lock_path, 'a+', encoding='UTF-8') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                owner = force or self._due()
+            except BlockingIOError:
+                owner = False
+
+            reports = {
+                category: asdict(
+                    sweep_category(category, db_path, self._recorder.drain(category), sweep=owner)
+                )
+                for category, db_path in self._databases.items()
+            }
+
+            if owner:
+                self._report_path.write_text(
+                    json.dumps({
+                        'timestamp': int(time.time()),
+                        'categories': reports
+                    }), encoding='UTF-8'
+                )
+                logger.info(
+                    'Cache maintenance: %s',
+                    ', '.join(
+                        f"{category} expired={report['expired']} evicted={report['evicted']}"
+                        for category, report in reports.items()
+                    )
+                )
+
+        return reports
+
+    def _due(self) -> bool:
+        report = read_report()
+        return time.time() - report.get('timestamp', 0) >= self._interval * 0.9
+
+
+access_recorder = AccessRecorder()
@@ -0,0 +1,395 @@
+"""
+Feed Proxy API: dependencies package; upstream and client rate limiting module
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from http import HTTPStatus
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+import humanfriendly
+from requests.exceptions import RequestException
+from starlette.types import Receive, Scope, Send
+
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+from feed_proxy.dependencies.stores import SQLiteStore
+
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+CLIENT_PRUNE_EVERY = 60
+
+logger = logging.getLogger('gunicorn.error')
+
+# The priority of the upstream requests being made; user facing unless marked as background work
+request_priority: ContextVar[int] = ContextVar('request_priority', default=PRIORITY_USER)
+
+
+@dataclass
+class ClientUsage:
+    """
+    The upstream requests, the cache misses, made while handling a client's request
+    """
+
+    upstream: int = 0
+
+
+# The usage of the client request being handled, if it's being rate limited
+client_usage: ContextVar[Optional[ClientUsage]] = ContextVar('client_usage', default=None)
+
+
+def count_upstream_request() -> None:
+    """
+    Count an upstream request against the client request being handled, if there is one
+    """
+
+    usage = client_usage.get()
+    if usage is not None:
+        usage.upstream += 1
+
+
+class RateLimited(RequestException):
+    """
+    An upstream request couldn't be scheduled within what's left of its deadline
+    """
+
+
+@contextmanager
+def background_priority() -> Iterator[None]:
+    """
+    Mark the upstream requests made inside the block as lower priority background work
+    """
+
+    token = request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class BucketStore(SQLiteStore):
+    """
+    Token buckets for each rate limited upstream host, shared by all the workers
+
+    User facing requests that have to wait reserve the host until their turn comes round, and
+    background requests hold back until no user facing request has a reservation.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            host TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            reserved_until REAL NOT NULL
+        );
+    """
+
+    def take(self, host: str, rate: float, priority: int) -> float:
+        """
+        Take a token from a host's bucket, returning 0 on success or otherwise how long to wait
+        before trying again
+        """
+
+        capacity = max(1.0, rate)
+        with self.connection() as con:
+            con.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            tokens, reserved_until = self._refill(con, host, rate, capacity, now)
+
+            blocked = priority == PRIORITY_BACKGROUND and now < reserved_until
+            if tokens >= 1.0 and not blocked:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = max((1.0 - tokens) / rate, reserved_until - now if blocked else 0.0)
+                if priority == PRIORITY_USER:
+                    reserved_until = max(reserved_until, now + wait + 1.0 / rate)
+
+            self._save(con, host, tokens, now, reserved_until)
+
+        return wait
+
+    def spend(self, spent: Dict[str, float], rate: float, capacity: float) -> Dict[str, float]:
+        """
+        Take the tokens spent from each bucket in a single transaction, running into debt of up to
+        a full bucket if there aren't enough, and return the tokens each bucket has left
+        """
+
+        levels = {}
+        with self.connection() as con:
+            con.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            for host, cost in spent.items():
+                tokens, reserved_until = self._refill(con, host, rate, capacity, now)
+                levels[host] = max(-capacity, tokens - cost)
+                self._save(con, host, levels[host], now, reserved_until)
+
+        return levels
+
+    def prune(self, before: float) -> int:
+        """
+        Forget buckets last used before a timestamp, returning how many were forgotten
+        """
+
+        with self.connection() as con:
+            return con.execute('DELETE FROM buckets WHERE updated_at < ?', (before, )).rowcount
+
+    @staticmethod
+    def _refill(
+        con: sqlite3.Connection, host: str, rate: float, capacity: float, now: float
+    ) -> Tuple[float, float]:
+        row = con.execute(
+            'SELECT tokens, updated_at, reserved_until FROM buckets WHERE host = ?', (host, )
+        ).fetchone()
+        tokens, updated_at, reserved_until = row or (capacity, now, 0.0)
+        return min(capacity, tokens + max(0.0, now - updated_at) * rate), reserved_until
+
+    @staticmethod
+    def _save(
+        con: sqlite3.Connection, host: str, tokens: float, now: float, reserved_until: float
+    ) -> None:
+        con.execute(
+            """INSERT OR REPLACE INTO buckets (host, tokens, updated_at, reserved_until)
+            VALUES (?, ?, ?, ?)""",
+            (host, tokens, now, reserved_until)
+        )
+
+
+class RateLimiter:    # pylint: disable=too-few-public-methods
+    """
+    Paces upstream requests to each rate limited host, in requests per second
+    """
+
+    def __init__(self, buckets: BucketStore, limits: Dict[str, float]) -> None:
+        self._buckets = buckets
+        self._limits = {host.lower(): rate for host, rate in limits.items() if rate > 0}
+
+    def wait(self, url: str, remaining: Optional[float] = None) -> None:
+        """
+        Wait for a turn to request a URL, raising RateLimited if that would take longer than the
+        remaining seconds
+        """
+
+        host = (urlsplit(url).hostname or '').lower()
+        rate = self._limits.get(host)
+        if rate is None:
+            return
+
+        priority = request_priority.get()
+        waited = 0.0
+        while (wait := self._buckets.take(host, rate, priority)) > 0:
+            if remaining is not None and waited + wait > remaining:
+                metrics.increment(f'ratelimit.{host}.rejected')
+                raise RateLimited(f'No turn for {host} within the deadline')
+
+            time.sleep(wait)
+            waited += wait
+
+        if waited:
+            metrics.increment(f'ratelimit.{host}.waits')
+            metrics.increment(f'ratelimit.{host}.waited', round(waited, 3))
+            logger.debug('Waited %.3fs for a turn at %s', waited, host)
+
+
+@lru_cache
+def rate_limiter() -> RateLimiter:
+    """
+    Get and return the upstream rate limiter, opening its bucket store on first use
+    """
+
+    settings = get_settings()
+    return RateLimiter(
+        BucketStore(settings.store_path / 'ratelimits.sqlite'), settings.api_rate_limits
+    )
+
+
+os.register_at_fork(after_in_child=rate_limiter.cache_clear)
+
+
+class ClientBuckets:    # pylint: disable=too-many-instance-attributes
+    """
+    Token buckets for each client, held in memory by each worker and kept in step with buckets
+    shared by all the workers
+
+    Requests take and are charged tokens in memory, so rate limiting a request never touches
+    SQLite. Every interval a background thread takes the tokens spent since the last sync from the
+    shared buckets in a single transaction, and sets each local bucket to what the shared one has
+    left. Between syncs a client can spend at most a bucket's worth of tokens in each worker.
+    """
+
+    def __init__(self, store: BucketStore, rate: float, capacity: float, interval: float) -> None:
+        self._store = store
+        self._rate = rate
+        self._capacity = capacity
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Tuple[float, float]] = {}
+        self._spent: Dict[str, float] = {}
+        self._stopped = threading.Event()
+        self._syncs = 0
+
+    def start(self) -> None:
+        """
+        Start syncing with the shared buckets
+        """
+
+        self._stopped.clear()
+        threading.Thread(target=self._run, name='client-buckets', daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Stop syncing, after pushing what's been spent since the last sync
+        """
+
+        self._stopped.set()
+        self.sync()
+
+    def take(self, key: str) -> float:
+        """
+        Take a token from a client's bucket, returning 0 on success or otherwise how long to wait
+        before there's one to take
+        """
+
+        with self._lock:
+            now = time.time()
+            tokens = self._refill(key, now)
+            if tokens < 1.0:
+                self._tokens[key] = (tokens, now)
+                return (1.0 - tokens) / self._rate
+
+            self._tokens[key] = (tokens - 1.0, now)
+            self._spent[key] = self._spent.get(key, 0.0) + 1.0
+            return 0.0
+
+    def charge(self, key: str, cost: float) -> None:
+        """
+        Take extra tokens from a client's bucket after the fact, running into debt of up to a full
+        bucket if there aren't enough
+        """
+
+        with self._lock:
+            now = time.time()
+            self._tokens[key] = (max(-self._capacity, self._refill(key, now) - cost), now)
+            self._spent[key] = self._spent.get(key, 0.0) + cost
+
+    def sync(self) -> None:
+        """
+        Take the tokens spent since the last sync from the shared buckets and bring the local
+        buckets, including those only spent from by other workers, in step with them, forgetting
+        buckets that have refilled
+        """
+
+        with self._lock:
+            spent = {key: 0.0 for key in self._tokens}
+            spent.update(self._spent)
+            self._spent = {}
+
+        levels = self._store.spend(spent, self._rate, self._capacity) if spent else {}
+        now = time.time()
+        with self._lock:
+            for key, level in levels.items():
+                # Anything spent while syncing is already in the local bucket but not the shared one
+                tokens = max(-self._capacity, level - self._spent.get(key, 0.0))
+                self._tokens[key] = (tokens, now)
+
+            full = [key for key in self._tokens if self._refill(key, now) >= self._capacity]
+            for key in full:
+                if key not in self._spent:
+                    del self._tokens[key]
+
+        self._syncs += 1
+        if self._syncs % CLIENT_PRUNE_EVERY == 0:
+            self._store.prune(now - self._capacity / self._rate)
+
+    def _refill(self, key: str, now: float) -> float:
+        tokens, updated_at = self._tokens.get(key, (self._capacity, now))
+        return min(self._capacity, tokens + max(0.0, now - updated_at) * self._rate)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                self.sync()
+            except Exception:    # pylint: disable=broad-except
+                logger.exception('Client rate limit sync failed')
+
+
+@lru_cache
+def client_buckets() -> Optional[ClientBuckets]:
+    """
+    Get and return this worker's client rate limit buckets, opening the shared bucket store on
+    first use, or None if client rate limiting is turned off
+    """
+
+    settings = get_settings()
+    if settings.client_rate_limit <= 0:
+        return None
+
+    return ClientBuckets(
+        BucketStore(settings.store_path / 'clients.sqlite'),
+        rate=settings.client_rate_limit,
+        capacity=max(1.0, float(settings.client_rate_burst)),
+        interval=humanfriendly.parse_timespan(settings.client_rate_sync)
+    )
+
+
+os.register_at_fork(after_in_child=client_buckets.cache_clear)
+
+
+class ClientRateLimitMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    ASGI middleware to rate limit each client address's requests to each route, with each worker's
+    token buckets kept in step with the other workers'
+
+    Each request takes a token; a request that missed the cache is then charged upstream_cost more
+    tokens for each upstream request it made, so repeating a cached request is cheap but fanning
+    out upstream is not. Requests without a token get a 429 with Retry-After.
+    """
+    def __init__(
+        self,
+        app: FastAPI,
+        *,
+        upstream_cost: float,
+        exempt_routes: Optional[List[str]] = None
+    ) -> None:
+        self._app = app
+        self._upstream_cost = upstream_cost
+        self._exempt = tuple(exempt_routes or [])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        buckets = client_buckets()
+        if scope['type'] != 'http' or buckets is None or scope['path'].startswith(self._exempt):
+            return await self._app(scope, receive, send)
+
+        client_ip = scope['client'][0] if scope.get('client') else '-'
+        key = f"{client_ip} {scope['path']}"
+        wait = buckets.take(key)
+        if wait > 0:
+            metrics.increment('ratelimit.clients.rejected')
+            response = JSONResponse(
+                status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                content={'detail': 'Too many requests, try again later'},
+                headers={'Retry-After': str(math.ceil(wait))}
+            )
+            return await response(scope, receive, send)
+
+        usage = ClientUsage()
+        token = client_usage.set(usage)
+        try:
+            return await self._app(scope, receive, send)
+        finally:
+            client_usage.reset(token)
+            if usage.upstream and self._upstream_cost > 0:
+                cost = usage.upstream * self._upstream_cost
+                metrics.increment('ratelimit.clients.charged', cost)
+                buckets.charge(key, cost)
@@ -0,0 +1,183 @@
+"""
+Feed Proxy API: dependencies package; compact cache serializer module
+"""
+
+import datetime
+import json
+import logging
+from pathlib import Path
+import struct
+from typing import Optional
+import zlib
+
+from requests.structures import CaseInsensitiveDict
+from requests_cache import CachedResponse, SerializerPipeline, Stage
+from requests_cache.models import CachedRequest
+
+from feed_proxy.common.settings import get_settings
+
+logger = logging.getLogger('gunicorn.error')
+
+MAGIC = b'FPC1'
+HEADER = struct.Struct('>4sI')
+PEEK_SIZE = 1024
+KEPT_HEADERS = (
+    'Cache-Control',
+    'Content-Type',
+    'Date',
+    'ETag',
+    'Expires',
+    'Last-Modified',
+)
+
+
+def _timestamp(value: Optional[datetime.datetime]) -> Optional[float]:
+    if value is None:
+        return None
+
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _datetime(value: Optional[float]) -> Optional[datetime.datetime]:
+    if value is None:
+        return None
+
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).replace(tzinfo=None)
+
+
+class CompactStage(Stage):    # pylint: disable=too-few-public-methods
+    """
+    Serialize a cached response as its status, selected headers, expiry and body only, compressed
+    with zlib and an optional preset dictionary shared by all entries in a cache category.
+
+    Entries written with a different format or dictionary raise ValueError on load, which
+    requests_cache treats as a cache miss.
+    """
+
+    def __init__(self, level: int = zlib.Z_DEFAULT_COMPRESSION, zdict: Optional[bytes] = None):
+        super().__init__(dumps=self._dumps, loads=self._loads)
+        self.level = level
+        self.zdict = zdict
+        self.zdict_id = zlib.crc32(zdict) if zdict else 0
+
+    def _dumps(self, response: CachedResponse) -> bytes:
+        meta = {
+            's': response.status_code,
+            'r': response.reason,
+            'u': response.url,
+            'n': response.encoding,
+            'h': {
+                name: response.headers[name]
+                for name in KEPT_HEADERS if name in response.headers
+            },
+            'c': _timestamp(response.created_at),
+            'e': _timestamp(response.expires)
+        }
+        if response.request is not None and response.request.url != response.url:
+            meta['q'] = response.request.url
+
+        payload = json.dumps(meta, separators=(',', ':')).encode() + b'\0' + (response.content or b'')
+        if self.zdict:
+            compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        else:
+            compressor = zlib.compressobj(self.level)
+
+        return HEADER.pack(MAGIC, self.zdict_id) + compressor.compress(payload) + compressor.flush()
+
+    def url(self, value: bytes) -> Optional[str]:
+        """
+        Get the URL of a serialized response, decompressing only as far as the end of its metadata
+        rather than its body, or None if it can't be read
+        """
+
+        try:
+            decompressor = self._decompressor(value)
+            data = value[HEADER.size:]
+            meta = b''
+            while b'\0' not in meta:
+                chunk = decompressor.decompress(data, PEEK_SIZE)
+                if not chunk:
+                    return None
+                meta += chunk
+                data = decompressor.unconsumed_tail
+            return json.loads(meta.partition(b'\0')[0])['u']
+        except (KeyError, ValueError, zlib.error):
+            return None
+
+    def _decompressor(self, value: bytes) -> 'zlib._Decompress':
+        try:
+            magic, zdict_id = HEADER.unpack_from(value)
+        except struct.error as exc:
+            raise ValueError('Not a compact cache entry') from exc
+
+        if magic != MAGIC:
+            raise ValueError('Not a compact cache entry')
+        if zdict_id != self.zdict_id:
+            raise ValueError('Compact cache entry uses a different dictionary')
+
+        return zlib.decompressobj(zdict=self.zdict) if self.zdict else zlib.decompressobj()
+
+    def _loads(self, value: bytes) -> CachedResponse:
+        decompressor = self._decompressor(value)
+        try:
+            payload = decompressor.decompress(value[HEADER.size:]) + decompressor.flush()
+        except zlib.error as exc:
+            raise ValueError(f'Corrupt compact cache entry: {exc}') from exc
+        if not decompressor.eof:
+            raise ValueError('Truncated compact cache entry')
+
+        raw_meta, _, body = payload.partition(b'\0')
+        meta = json.loads(raw_meta)
+
+        # CachedResponse is an attrs class, whose generated constructor pylint can't see
+        return CachedResponse(    # pylint: disable=unexpected-keyword-arg
+            content=body,
+            status_code=meta['s'],
+            reason=meta['r'],
+            url=meta['u'],
+            encoding=meta['n'],
+            headers=CaseInsensitiveDict(meta['h']),
+            created_at=_datetime(meta['c']) or datetime.datetime.utcnow(),
+            expires=_datetime(meta['e']),
+            request=CachedRequest(method='GET', url=meta.get('q', meta['u']))
+        )
+
+
+def serialized_url(serializer: Optional[SerializerPipeline], value: bytes) -> Optional[str]:
+    """
+    Get the URL of a response stored by a compact serializer without loading the response, or
+    None if it wasn't stored by one
+    """
+
+    stages = serializer.stages if serializer is not None else []
+    if not stages or not isinstance(stages[0], CompactStage):
+        return None
+
+    return stages[0].url(value)
+
+
+def load_dictionary(category: str) -> Optional[bytes]:
+    """
+    Load the optional shared compression dictionary for a cache category
+    """
+
+    settings = get_settings()
+    if not settings.cache_dictionaries:
+        return None
+
+    path = Path(settings.cache_dictionaries) / f'{category}.dict'
+    if not path.is_file():
+        return None
+
+    logger.debug('Using %s compression dictionary %s', category, path)
+    return path.read_bytes()
+
+
+def compact_serializer(category: str) -> SerializerPipeline:
+    """
+    Build the compact serializer for a cache category
+    """
+
+    settings = get_settings()
+    stage = CompactStage(level=settings.cache_compression_level, zdict=load_dictionary(category))
+    return SerializerPipeline([stage], name=f'compact-{category}', is_binary=True)
@@ -0,0 +1,318 @@
+"""
+Feed Proxy API: dependencies package; local data stores module
+"""
+
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from feed_proxy.common.settings import get_settings
+
+SQLITE_TIMEOUT = 30.0
+HOUR = 3600
+SECTION_REFRESH_INTERVAL = 300
+
+
+class SQLiteStore:    # pylint: disable=too-few-public-methods
+    """
+    Base for small, local SQLite backed stores
+
+    A connection is opened per operation; these are cheap for SQLite and mean a store is safe to
+    share between threads and across forked workers.
+    """
+
+    SCHEMA: str = ''
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connection() as con:
+            con.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection, committing on success and rolling back on error
+        """
+
+        with closing(sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT)) as con:
+            with con:
+                yield con
+
+
+class CheckinStore(SQLiteStore):
+    """
+    The checkins seen so far, so the newest can be served when Foursquare has nothing newer
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkins (
+            id TEXT PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            item TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS created_at_idx ON checkins(created_at);
+    """
+
+    def latest(self) -> Optional[dict]:
+        """
+        Get the most recent stored checkin, if there is one
+        """
+
+        with self.connection() as con:
+            row = con.execute('SELECT item FROM checkins ORDER BY created_at DESC LIMIT 1').fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def save(self, item: dict) -> None:
+        """
+        Store a checkin
+        """
+
+        with self.connection() as con:
+            con.execute(
+                'INSERT OR REPLACE INTO checkins (id, created_at, item) VALUES (?, ?, ?)',
+                (item.get('id', str(item['createdAt'])), item['createdAt'], json.dumps(item))
+            )
+
+
+class ListenStore(SQLiteStore):
+    """
+    An append only store of ListenBrainz listens, synced incrementally and capped at max_listens
+
+    Hourly listen counts per artist and per release group are kept up to date as listens are
+    added, so top artists and releases over any window are a single indexed query. The counts
+    aren't capped with the listens themselves.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS listens (
+            listened_at INTEGER NOT NULL,
+            msid TEXT NOT NULL,
+            item TEXT NOT NULL,
+            PRIMARY KEY (listened_at, msid)
+        );
+        CREATE TABLE IF NOT EXISTS listen_counts (
+            kind TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            mbid TEXT,
+            name TEXT NOT NULL,
+            artist_name TEXT,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (kind, hour, key)
+        );
+    """
+
+    def __init__(self, db_path: Path, max_listens: int) -> None:
+        super().__init__(db_path)
+        self.max_listens = max_listens
+        with self.connection() as con:
+            if not con.execute('SELECT 1 FROM listen_counts LIMIT 1').fetchone():
+                for (item, ) in con.execute('SELECT item FROM listens').fetchall():
+                    self._count(con, json.loads(item))
+
+    def latest_timestamp(self) -> Optional[int]:
+        """
+        Get the timestamp of the most recent stored listen, if there is one
+        """
+
+        with self.connection() as con:
+            return con.execute('SELECT MAX(listened_at) FROM listens').fetchone()[0]
+
+    def counted_since(self) -> Optional[int]:
+        """
+        Get the start of the hour of the earliest counted listen, if there is one
+        """
+
+        with self.connection() as con:
+            hour = con.execute('SELECT MIN(hour) FROM listen_counts').fetchone()[0]
+
+        return hour * HOUR if hour is not None else None
+
+    def recent(self, count: int) -> List[dict]:
+        """
+        Get the most recent stored listens, newest first
+        """
+
+        with self.connection() as con:
+            rows = con.execute(
+                'SELECT item FROM listens ORDER BY listened_at DESC LIMIT ?', (count, )
+            ).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def top(self, kind: str, since: Optional[int], count: int) -> List[dict]:
+        """
+        Get the most listened to artists (kind='artist') or release groups
+        (kind='release_group') since a timestamp, or of all time
+        """
+
+        with self.connection() as con:
+            rows = con.execute(
+                """SELECT mbid, MAX(name), MAX(artist_name), SUM(count) AS listens
+                FROM listen_counts WHERE kind = ? AND hour >= ?
+                GROUP BY key ORDER BY listens DESC, MAX(name) LIMIT ?""",
+                (kind, (since or 0) // HOUR, count)
+            ).fetchall()
+
+        return [
+            {
+                'mbid': mbid,
+                'name': name,
+                'artist_name': artist_name,
+                'listen_count': listens
+            } for mbid, name, artist_name, listens in rows
+        ]
+
+    def add(self, listens: Iterable[dict]) -> int:
+        """
+        Store new listens, ignoring any already stored, and return how many were added
+        """
+
+        added = 0
+        with self.connection() as con:
+            for listen in listens:
+                if 'listened_at' not in listen:
+                    continue
+                cursor = con.execute(
+                    'INSERT OR IGNORE INTO listens (listened_at, msid, item) VALUES (?, ?, ?)',
+                    (listen['listened_at'], self._key(listen), json.dumps(listen))
+                )
+                if cursor.rowcount:
+                    self._count(con, listen)
+                    added += 1
+
+            if added:
+                con.execute(
+                    """DELETE FROM listens WHERE listened_at < (
+                        SELECT listened_at FROM listens ORDER BY listened_at DESC LIMIT 1 OFFSET ?
+                    )""",
+                    (self.max_listens - 1, )
+                )
+
+        return added
+
+    @staticmethod
+    def _key(listen: dict) -> str:
+        if listen.get('recording_msid'):
+            return listen['recording_msid']
+
+        meta = listen.get('track_metadata', {})
+        return f"{meta.get('artist_name')}\0{meta.get('track_name')}"
+
+    @staticmethod
+    def _count(con: sqlite3.Connection, listen: dict) -> None:
+        meta = listen.get('track_metadata', {})
+        mapping = meta.get('mbid_mapping') or {}
+        info = meta.get('additional_info') or {}
+        hour = listen['listened_at'] // HOUR
+
+        counts = []
+        artists = mapping.get('artists') or []
+        if artists:
+            for artist in artists:
+                counts.append(
+                    ('artist', artist['artist_mbid'], artist['artist_credit_name'], None)
+                )
+        elif meta.get('artist_name'):
+            mbids = mapping.get('artist_mbids') or info.get('artist_mbids') or []
+            counts.append(
+                ('artist', mbids[0] if len(mbids) == 1 else None, meta['artist_name'], None)
+            )
+
+        release_group = mapping.get('release_group_mbid') or info.get('release_group_mbid')
+        if release_group and meta.get('release_name'):
+            counts.append(
+                ('release_group', release_group, meta['release_name'], meta.get('artist_name'))
+            )
+
+        con.executemany(
+            """INSERT INTO listen_counts (kind, hour, key, mbid, name, artist_name, count)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (kind, hour, key) DO UPDATE SET count = count + 1""",
+            [
+                (kind, hour, mbid or name.lower(), mbid, name, artist_name)
+                for kind, mbid, name, artist_name in counts
+            ]
+        )
+
+
+class SectionStore(SQLiteStore):
+    """
+    The last known good version of each response section, served when a section can't be built
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sections (
+            key TEXT PRIMARY KEY,
+            updated_at INTEGER NOT NULL,
+            items TEXT NOT NULL
+        );
+    """
+
+    def get(self, key: str) -> Optional[Tuple[list, int]]:
+        """
+        Get the items of a stored section and when they were stored, if there are any
+        """
+
+        with self.connection() as con:
+            row = con.execute(
+                'SELECT items, updated_at FROM sections WHERE key = ?', (key, )
+            ).fetchone()
+
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: str, items: list) -> None:
+        """
+        Store a section's items; unchanged items are only rewritten, to bring their stored time up
+        to date, once every SECTION_REFRESH_INTERVAL seconds
+        """
+
+        now = int(time.time())
+        encoded = json.dumps(items)
+        with self.connection() as con:
+            row = con.execute(
+                'SELECT items, updated_at FROM sections WHERE key = ?', (key, )
+            ).fetchone()
+            if row and row[0] == encoded and row[1] > now - SECTION_REFRESH_INTERVAL:
+                return
+
+            con.execute(
+                'INSERT OR REPLACE INTO sections (key, updated_at, items) VALUES (?, ?, ?)',
+                (key, now, encoded)
+            )
+
+
+@dataclass
+class DataStores:
+    """
+    Local data stores
+    """
+
+    checkins: CheckinStore
+    listens: ListenStore
+    sections: SectionStore
+
+
+@lru_cache
+def stores() -> DataStores:
+    """
+    Get and return the local data stores, opening them on first use
+    """
+
+    settings = get_settings()
+    return DataStores(
+        checkins=CheckinStore(settings.store_path / 'checkins.sqlite'),
+        listens=ListenStore(settings.store_path / 'listens.sqlite', settings.store_max_listens),
+        sections=SectionStore(settings.store_path / 'sections.sqlite')
+    )
+
+
+os.register_at_fork(after_in_child=stores.cache_clear)
@@ -0,0 +1,253 @@
+"""
+Feed Proxy API: dependencies package; upstream HTTP connection pool module
+"""
+
+from contextvars import ContextVar
+from functools import lru_cache
+from http import HTTPStatus
+import os
+import socket
+import time
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+import humanfriendly
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from requests_cache import CachedSession
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+from feed_proxy.dependencies.ratelimit import (
+    RateLimited, RateLimiter, count_upstream_request, rate_limiter
+)
+
+STATUSES = [500, 502, 503, 504]
+MIN_TIMEOUT = 0.05
+
+
+class Deadline:
+    """
+    An end to end latency budget for a route, shared by all the upstream requests it makes
+    """
+
+    def __init__(self, budget: Optional[float]) -> None:
+        self.expires = time.monotonic() + budget if budget is not None else None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Get the number of seconds left, or None if there's no deadline
+        """
+
+        return max(0.0, self.expires - time.monotonic()) if self.expires is not None else None
+
+    def expired(self) -> bool:
+        """
+        Check whether the budget has been used up
+        """
+
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+# The deadline of the route being handled, so that retries made deep inside urllib3 can see it
+active_deadline: ContextVar[Optional[Deadline]] = ContextVar('active_deadline', default=None)
+
+
+class DeadlineRetry(Retry):
+    """
+    Retries that stop, and backoff that shrinks, as the active route's deadline runs out
+    """
+
+    def is_exhausted(self) -> bool:
+        deadline = active_deadline.get()
+        return super().is_exhausted() or (deadline is not None and deadline.expired())
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        deadline = active_deadline.get()
+        remaining = deadline.remaining() if deadline is not None else None
+        return min(backoff, remaining) if remaining is not None else backoff
+
+
+def route_deadline(route: str) -> Callable[[], AsyncIterator[Deadline]]:
+    """
+    Build a dependency that starts a route's deadline and makes it the active deadline while the
+    route is handled
+    """
+
+    async def _deadline() -> AsyncIterator[Deadline]:
+        settings = get_settings()
+        budget = getattr(settings, f'api_deadline_{route}') or settings.api_deadline
+        deadline = Deadline(humanfriendly.parse_timespan(budget) if budget else None)
+        token = active_deadline.set(deadline)
+        try:
+            yield deadline
+        finally:
+            active_deadline.reset(token)
+
+    return _deadline
+
+
+def keepalive_options(idle: int) -> list:
+    """
+    Build socket options that enable TCP keep-alive probes on pooled connections after they've
+    been idle for a number of seconds
+    """
+
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4)))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle))
+
+    return options
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    A transport adapter whose connection pools are shared by every cached session, so connections
+    to an upstream host are reused whichever cache category a request belongs to
+
+    Only requests that miss the cache reach the adapter; these are paced by the rate limiter and
+    counted against the client request being handled.
+    """
+
+    def __init__(
+        self,
+        *args,
+        keepalive: Optional[int] = None,
+        limiter: Optional[RateLimiter] = None,
+        **kwargs
+    ) -> None:
+        self._keepalive = keepalive
+        self._limiter = limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs) -> Response:    # pylint: disable=arguments-differ
+        count_upstream_request()
+        if self._limiter is not None:
+            deadline = active_deadline.get()
+            self._limiter.wait(request.url, deadline.remaining() if deadline else None)
+        return super().send(request, *args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        if self._keepalive:
+            kwargs['socket_options'] = keepalive_options(self._keepalive)
+        super().init_poolmanager(*args, **kwargs)
+
+    def usage(self) -> Dict[str, int]:
+        """
+        Get the number of host pools and the in use, idle and total connection slots across them
+        """
+
+        usage = {'hosts': 0, 'in_use': 0, 'idle': 0, 'slots': 0}
+        pools = self.poolmanager.pools
+        with pools.lock:
+            host_pools = list(pools._container.values())    # pylint: disable=protected-access
+
+        for pool in host_pools:
+            queue = pool.pool
+            if queue is None:
+                continue
+            with queue.mutex:
+                idle = sum(1 for conn in queue.queue if conn is not None)
+                free = len(queue.queue)
+            usage['hosts'] += 1
+            usage['slots'] += queue.maxsize
+            usage['in_use'] += queue.maxsize - free
+            usage['idle'] += idle
+
+        return usage
+
+
+def upstream_timeout(deadline: Optional[Deadline] = None) -> Tuple[float, float]:
+    """
+    Get the (connect, read) timeout for upstream requests, shrunk to fit what's left of a deadline
+    """
+
+    settings = get_settings()
+    connect = settings.api_connect_timeout or settings.api_timeout
+    read = settings.api_read_timeout or settings.api_timeout
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is not None:
+        remaining = max(remaining, MIN_TIMEOUT)
+        connect, read = min(connect, remaining), min(read, remaining)
+
+    return connect, read
+
+
+def budgeted_get(
+    session: CachedSession,
+    deadline: Optional[Deadline],
+    **kwargs,
+) -> Optional[Response]:
+    """
+    Make an optional upstream request, such as for enrichment, within a deadline; once the deadline
+    has run out only a cached response is used, and None is returned if there's none in time
+    """
+
+    exhausted = deadline is not None and deadline.expired()
+    try:
+        rsp = session.get(timeout=upstream_timeout(deadline), only_if_cached=exhausted, **kwargs)
+    except RequestException as exc:
+        if isinstance(exc, RateLimited) or (deadline is not None and deadline.expired()):
+            return None
+        raise
+
+    if exhausted and rsp.status_code == HTTPStatus.GATEWAY_TIMEOUT:
+        return None
+
+    return rsp
+
+
+def pool_usage() -> Dict[str, int]:
+    """
+    Get the upstream connection pool usage, without building the pool if it isn't in use yet
+    """
+
+    if not upstream_adapter.cache_info().currsize:
+        return {'hosts': 0, 'in_use': 0, 'idle': 0, 'slots': 0}
+
+    return upstream_adapter().usage()
+
+
+def pool_utilisation() -> float:
+    """
+    Get the fraction of upstream connection slots currently in use
+    """
+
+    usage = pool_usage()
+    return round(usage['in_use'] / usage['slots'], 4) if usage['slots'] else 0.0
+
+
+@lru_cache
+def upstream_adapter() -> PooledAdapter:
+    """
+    Get and return the shared upstream transport adapter, building it on first use
+    """
+
+    settings = get_settings()
+    return PooledAdapter(
+        pool_connections=settings.api_pool_connections,
+        pool_maxsize=settings.api_pool_maxsize,
+        pool_block=settings.api_pool_block,
+        max_retries=DeadlineRetry(
+            total=settings.api_retries,
+            backoff_factor=settings.api_backoff,
+            status_forcelist=STATUSES
+        ),
+        keepalive=int(humanfriendly.parse_timespan(settings.api_keepalive))
+        if settings.api_keepalive else None,
+        limiter=rate_limiter()
+    )
+
+
+os.register_at_fork(after_in_child=upstream_adapter.cache_clear)
+metrics.gauge('upstream.pool.hosts', lambda: pool_usage()['hosts'])
+metrics.gauge('upstream.pool.in_use', lambda: pool_usage()['in_use'])
+metrics.gauge('upstream.pool.idle', lambda: pool_usage()['idle'])
+metrics.gauge('upstream.pool.utilisation', pool_utilisation)
@@ -0,0 +1,127 @@
+"""
+Feed Proxy API: methods package; cache administration module
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.middleware import stale_responses
+from feed_proxy.common.settings import get_settings
+from feed_proxy.dependencies.cache import SessionCaches, sqlite_cache
+from feed_proxy.dependencies.icons import StaticIcons
+from feed_proxy.dependencies.ratelimit import background_priority
+from feed_proxy.dependencies.serializers import serialized_url
+from feed_proxy.dependencies.stores import DataStores
+from feed_proxy.methods.checkins import current_checkin
+from feed_proxy.methods.music import current_music
+from feed_proxy.methods.weather import current_weather
+
+logger = logging.getLogger('gunicorn.error')
+
+FEEDS = ['checkin', 'listening', 'weather']
+
+
+def cache_stats(sessions: SessionCaches) -> dict:
+    """
+    Get entry counts, sizes and this worker's hit rates for each cache category
+    """
+
+    stats = {}
+    for category, session in sessions.categories().items():
+        responses = sqlite_cache(session).responses
+        with responses.connection() as con:
+            size = con.execute(
+                f'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {responses.table_name}'
+            ).fetchone()[0]
+
+        entries = responses.count()
+        hits = metrics.counter(f'cache.{category}.hits')
+        misses = metrics.counter(f'cache.{category}.misses')
+        db_path = Path(responses.db_path)
+        stats[category] = {
+            'entries': entries,
+            'expired': entries - responses.count(expired=False),
+            'size': size,
+            'file_size': db_path.stat().st_size if db_path.exists() else 0,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None
+        }
+
+    return stats
+
+
+def purge_cache(
+    sessions: SessionCaches,
+    prefix: Optional[str] = None,
+    mbid: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+) -> Dict[str, int]:
+    """
+    Delete the cached responses whose URL starts with a prefix or contains a MusicBrainz ID, and
+    the stale feed responses kept for shedding load that may have been built from them; URLs are
+    read from the stored entries without loading the responses
+    """
+
+    purged = {}
+    for category, session in sessions.categories().items():
+        if categories and category not in categories:
+            continue
+
+        responses = sqlite_cache(session).responses
+        with responses.connection() as con:
+            rows = con.execute(f'SELECT key, value FROM {responses.table_name}').fetchall()
+
+        keys = []
+        for key, value in rows:
+            url = serialized_url(responses.serializer, value) or ''
+            if (prefix and url.startswith(prefix)) or (mbid and mbid in url):
+                keys.append(key)
+
+        if keys:
+            responses.bulk_delete(keys)
+            logger.info('Purged %s cached %s responses', len(keys), category)
+
+        purged[category] = len(keys)
+
+    if any(purged.values()):
+        stale_responses().clear()
+
+    return purged
+
+
+def warm_feed(    # pylint: disable=too-many-arguments
+    feed: str,
+    icons: StaticIcons,
+    sessions: SessionCaches,
+    stores: DataStores,
+    count: int,
+    lng: Optional[float] = None,
+    lat: Optional[float] = None,
+) -> None:
+    """
+    Fetch a feed so its upstream responses are cached, as background work that gives way to user
+    facing requests
+    """
+
+    settings = get_settings()
+    try:
+        with background_priority():
+            if feed == 'listening':
+                current_music(icons=icons, count=count, sessions=sessions, stores=stores)
+            elif feed == 'weather':
+                current_weather(
+                    icons=icons,
+                    lng=lng if lng is not None else settings.default_lng,
+                    lat=lat if lat is not None else settings.default_lat,
+                    sessions=sessions
+                )
+            elif feed == 'checkin':
+                current_checkin(icons, sessions, stores)
+
+        logger.info('Warmed %s feed', feed)
+
+    except Exception:    # pylint: disable=broad-except
+        logger.exception('Failed to warm %s feed', feed)
@@ -5,33 +5,51 @@ Feed Proxy API: methods package; checkins module
 import datetime
 from http import HTTPStatus
 import logging
+from typing import Optional
 
-from fastapi import Request
+from fastapi.exceptions import HTTPException
 from fastapi.responses import JSONResponse
+from requests.exceptions import RequestException
 
 from feed_proxy.common.settings import get_settings
 from feed_proxy.dependencies.cache import SessionCaches
+from feed_proxy.dependencies.icons import StaticIcons
+from feed_proxy.dependencies.ratelimit import RateLimited
+from feed_proxy.dependencies.stores import DataStores
+from feed_proxy.dependencies.upstream import Deadline, upstream_timeout
 from feed_proxy.methods.weather import current_weather
 
 logger = logging.getLogger('gunicorn.error')
 
 
-def current_checkin(request: Request, sessions: SessionCaches) -> JSONResponse:
+def current_checkin(
+    icons: StaticIcons,
+    sessions: SessionCaches,
+    stores: DataStores,
+    deadline: Optional[Deadline] = None,
+) -> JSONResponse:
     """
-    Get the current checkin from Swarm/Foursquare
+    Get the current checkin from Swarm/Foursquare, without the weather if the deadline runs out
+    before it can be fetched
     """
 
     settings = get_settings()
 
+    # Only ask Foursquare for checkins newer than the latest one already stored, and fall back
+    # to the stored checkin when there's nothing new
+    latest = stores.checkins.latest()
     params = {
         'user_id': 'self',
         'v': '20230501',
         'oauth_token': settings.foursq_oauth_token,
+        'sort': 'newestfirst',
         'limit': 1
     }
+    if latest:
+        params['afterTimestamp'] = latest['createdAt']
 
     url = f'{settings.foursq_api_url}/v2/users/self/checkins'
-    rsp = sessions.weather.get(url=url, params=params, timeout=settings.api_timeout)
+    rsp = sessions.checkins.get(url=url, params=params, timeout=upstream_timeout(deadline))
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code != HTTPStatus.OK:
@@ -44,7 +62,21 @@ def current_checkin(request: Request, sessions: SessionCaches) -> JSONResponse:
         )
 
     body = rsp.json()
-    item = body['response']['checkins']['items'][0]
+    items = body['response']['checkins']['items']
+    if items:
+        item = items[0]
+        if not latest or item['createdAt'] >= latest['createdAt']:
+            stores.checkins.save(item)
+    elif latest:
+        item = latest
+    else:
+        return JSONResponse(
+            status_code=HTTPStatus.NOT_FOUND.value, content={
+                'code': HTTPStatus.NOT_FOUND.value,
+                'details': 'No checkins found'
+            }
+        )
+
     venue = item['venue']
 
     icon = venue['categories'][0]['icon']
@@ -61,12 +93,19 @@ def current_checkin(request: Request, sessions: SessionCaches) -> JSONResponse:
     }
 
     coords = venue['location']
-    weather = current_weather(
-        request=request, lng=coords['lng'], lat=coords['lat'], sessions=sessions
-    )
+    try:
+        weather = current_weather(
+            icons=icons, lng=coords['lng'], lat=coords['lat'], sessions=sessions, deadline=deadline
+        ).dict()
+    except (HTTPException, RequestException) as exc:
+        if not isinstance(exc, RateLimited) and (deadline is None or not deadline.expired()):
+            raise
+        logger.warning('Out of time fetching checkin weather')
+        weather = None
+
     return JSONResponse(
         status_code=HTTPStatus.OK.value, content={
             'checkin': checkin,
-            'weather': weather.dict()
+            'weather': weather
         }
     )
@@ -2,164 +2,506 @@
 Feed Proxy API: methods package; music module
 """
 
+from dataclasses import dataclass
 from http import HTTPStatus
 import logging
 import os
-from typing import Optional
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
-from fastapi import Request
 from fastapi.exceptions import HTTPException
+import humanfriendly
 from pydantic import ValidationError
+from requests.exceptions import RequestException
 from starlette.datastructures import URL
 
 from feed_proxy.common.settings import get_settings
 from feed_proxy.dependencies.cache import SessionCaches, signed_cdn_url
-from feed_proxy.models.responses import Artist, CurrentMusic, Release, Track
+from feed_proxy.dependencies.cdn import cdn_warmer
+from feed_proxy.dependencies.icons import StaticIcons
+from feed_proxy.dependencies.stores import DataStores
+from feed_proxy.dependencies.upstream import Deadline, budgeted_get
+from feed_proxy.models.records import (
+    ArtistRecord,
+    CurrentMusicRecord,
+    ReleaseRecord,
+    SECTION_DEGRADED,
+    SECTION_FAILED,
+    SECTION_OK,
+    SECTION_STALE,
+    SectionStatusRecord,
+    TrackRecord,
+    upstream_url,
+)
+
+UPSTREAM_ERRORS = (HTTPException, RequestException)
+
+# An enrichment plan key is an image kind and an MBID; a gathered item is the fields of its record,
+# without the image, and the key of its image if it has one
+EnrichmentKey = Tuple[str, str]
+Gathered = Tuple[dict, Optional[EnrichmentKey]]
+LISTENBRAINZ_MAX_COUNT = 1000
+MIN_FETCH_WINDOW_BITS = 3
+LISTENS_SYNC_MAX_PAGES = 10
+
+# Named stats periods and their length in seconds; the ListenBrainz stats ranges are used as is
+# when the local listen counts don't go back far enough
+STATS_PERIODS = {
+    'day': 86400,
+    'week': 7 * 86400,
+    'month': 30 * 86400,
+    'quarter': 91 * 86400,
+    'half_yearly': 182 * 86400,
+    'year': 365 * 86400,
+    'all_time': None
+}
+LISTENBRAINZ_PERIODS = {'week', 'month', 'quarter', 'half_yearly', 'year', 'all_time'}
 
 logger = logging.getLogger('gunicorn.error')
 
 
-def current_music(
-    request: Request,
+def current_music(    # pylint: disable=too-many-arguments
+    icons: StaticIcons,
     count: int,
     sessions: SessionCaches,
-) -> CurrentMusic:
+    stores: DataStores,
+    period: str = 'week',
+    deadline: Optional[Deadline] = None,
+) -> CurrentMusicRecord:
     """
-    Get current music listening from ListenBrainz/MusicBrainz/Discogs
+    Get current music listening from ListenBrainz/MusicBrainz/Discogs; once the deadline runs out,
+    tracks, artists and releases are returned with whatever images are already cached
+
+    The listens and stats behind each section are gathered first, independently; a section whose
+    data can't be gathered is replaced by its last known good version if there is one, and the
+    status of each section is reported alongside them. The images the gathered sections need are
+    then looked up once each, however many tracks, artists and releases share them.
+    """
+
+    listening = CurrentMusicRecord()
+    plan = EnrichmentPlan(icons, sessions, deadline)
+    sections = [
+        MusicSection(
+            'tracks',
+            f'listening.tracks.{count}',
+            TrackRecord,
+            lambda: music_tracks(count, sessions, stores, plan, deadline)
+        ),
+        MusicSection(
+            'artists',
+            f'listening.artists.{count}.{period}' if period in STATS_PERIODS else None,
+            ArtistRecord,
+            lambda: music_artists(count, sessions, stores, period, plan, deadline)
+        ),
+        MusicSection(
+            'releases',
+            f'listening.releases.{count}.{period}' if period in STATS_PERIODS else None,
+            ReleaseRecord,
+            lambda: music_releases(count, sessions, stores, period, plan, deadline)
+        )
+    ]
+
+    gathered = {}
+    for section in sections:
+        try:
+            gathered[section.name] = section.gather()
+
+        except UPSTREAM_ERRORS as exc:
+            logger.warning('Failed to get %s: %r', section.name, exc)
+            stored = stores.sections.get(section.key) if section.key else None
+            if stored is None:
+                listening.status[section.name] = SectionStatusRecord(SECTION_FAILED, None)
+                setattr(listening, section.name, [])
+            else:
+                items, updated_at = stored
+                listening.status[section.name] = SectionStatusRecord(SECTION_STALE, updated_at)
+                setattr(
+                    listening, section.name, [section.record(**item) for item in items[:count]]
+                )
+
+    plan.resolve()
+
+    for section in sections:
+        if section.name not in gathered:
+            continue
+
+        items = []
+        degraded = False
+        for fields, enrichment in gathered[section.name]:
+            image, resolved = plan.image(enrichment)
+            degraded = degraded or not resolved
+            items.append(section.record(**fields, image=image))
+
+        if degraded:
+            listening.status[section.name] = SectionStatusRecord(SECTION_DEGRADED, None)
+        else:
+            if section.key:
+                stores.sections.put(section.key, [item.dict() for item in items])
+            listening.status[section.name] = SectionStatusRecord(SECTION_OK, None)
+
+        setattr(listening, section.name, items)
+
+    return listening
+
+
+@dataclass
+class MusicSection:
+    """
+    A section of the current music response: its name, the key of its last known good version
+    (None if it isn't kept, as for custom stats ranges), the record type of its items, and how to
+    gather the data behind them
+    """
+
+    name: str
+    key: Optional[str]
+    record: Type[Union[TrackRecord, ArtistRecord, ReleaseRecord]]
+    gather: Callable[[], List[Gathered]]
+
+
+class EnrichmentPlan:
+    """
+    The images needed by a single current music response
+
+    Keys are added as the sections are gathered, then each unique key is looked up once; the
+    image for a key is None, so the placeholder is used, if the lookup found nothing or failed.
+    """
+
+    def __init__(
+        self,
+        icons: StaticIcons,
+        sessions: SessionCaches,
+        deadline: Optional[Deadline] = None,
+    ) -> None:
+        self._icons = icons
+        self._sessions = sessions
+        self._deadline = deadline
+        self._keys: Dict[EnrichmentKey, None] = {}
+        self._images: Dict[EnrichmentKey, Tuple[Optional[str], bool]] = {}
+        self._discogs: Dict[str, URL] = {}
+
+    def add(self, kind: str, mbid: str) -> EnrichmentKey:
+        """
+        Add an image to the plan: cover art for a 'release' or 'release-group', or an 'artist'
+        image, by MBID
+        """
+
+        key = (kind, mbid)
+        self._keys[key] = None
+        return key
+
+    def resolve(self) -> None:
+        """
+        Look up each unique image in the plan
+        """
+
+        for key in self._keys:
+            if key in self._images:
+                continue
+
+            kind, mbid = key
+            try:
+                if kind == 'artist':
+                    image_url = self._artist_image(mbid)
+                else:
+                    image_url = coverart_image(
+                        mbid=mbid,
+                        icons=self._icons,
+                        sessions=self._sessions,
+                        metadata=kind,
+                        deadline=self._deadline
+                    )
+                image = str(image_url) if image_url else None
+                # Once the deadline has run out lookups are cache only, so a missing image may
+                # just not have been looked up in time
+                fell_back = out_of_time(self._deadline) and image in (None, self._icons.music)
+                self._images[key] = (image, not fell_back)
+
+            except UPSTREAM_ERRORS as exc:
+                logger.warning('Failed to get %s image for %s: %r', kind, mbid, exc)
+                self._images[key] = (None, False)
+
+    def image(self, key: Optional[EnrichmentKey]) -> Tuple[str, bool]:
+        """
+        Get the image for a key, or the placeholder, and whether its lookup succeeded, rather than
+        failing or running out of time
+        """
+
+        image, resolved = self._images.get(key, (None, True)) if key else (None, True)
+        return image or self._icons.music, resolved
+
+    def _artist_image(self, mbid: str) -> Optional[URL]:
+        artist_meta = musicbrainz_artist(
+            mbid=mbid, sessions=self._sessions, deadline=self._deadline
+        )
+        for rel in artist_meta.get('relations', []):
+            if rel['type'] == 'discogs':
+                discogs_id = os.path.split(URL(rel['url']['resource']).path)[1]
+                # Different MusicBrainz artists can share a Discogs artist
+                if discogs_id not in self._discogs:
+                    self._discogs[discogs_id] = discogs_artist_image(
+                        discogsid=discogs_id,
+                        icons=self._icons,
+                        sessions=self._sessions,
+                        deadline=self._deadline
+                    )
+                return self._discogs[discogs_id]
+
+        return None
+
+
+def music_tracks(
+    count: int,
+    sessions: SessionCaches,
+    stores: DataStores,
+    plan: EnrichmentPlan,
+    deadline: Optional[Deadline] = None,
+) -> List[Gathered]:
+    """
+    Gather the most recent tracks listened to, adding their cover art to the enrichment plan
     """
 
     settings = get_settings()
-    listening = CurrentMusic()
+    tracks: List[Gathered] = []
 
-    listens = listenbrainz_listens(sessions, count)
+    listens = listenbrainz_listens(sessions, stores, count, deadline)
     if 'payload' in listens and 'listens' in listens['payload']:
         for track in listens['payload']['listens']:
             if 'track_metadata' in track:
                 meta = track['track_metadata']
-                image_url = None
+                cover = None
                 track_url = None
                 if 'mbid_mapping' in meta:
                     if 'caa_release_mbid' in meta['mbid_mapping']:
-                        caa_mbid = meta['mbid_mapping']['caa_release_mbid']
-                        image_url = coverart_image(
-                            mbid=caa_mbid,
-                            request=request,
-                            sessions=sessions
-                        )
+                        cover = ('release', meta['mbid_mapping']['caa_release_mbid'])
                     if 'release_mbid' in meta['mbid_mapping']:
                         track_url = f"{settings.musicbrainz_url}/release/{meta['mbid_mapping']['release_mbid']}"
                     elif 'recording_mbid' in meta['mbid_mapping']:
                         track_url = f"{settings.musicbrainz_url}/recording/{meta['mbid_mapping']['recording_mbid']}"
 
-                if image_url:
-                    image = str(image_url)
-                else:
-                    image = str(
-                        request.url_for('static',
-                                        path='/heroicons/24/solid/musical-note.svg')
-                    )
-
                 try:
-                    listening.tracks.append(
-                        Track(
-                            artist=meta['artist_name'],
-                            track=meta['track_name'],
-                            url=track_url,
-                            image=image
-                        )
-                    )
+                    fields = {
+                        'artist': meta['artist_name'],
+                        'track': meta['track_name'],
+                        'url': upstream_url(track_url)
+                    }
                 except ValidationError:
-                    pass
+                    continue
 
-                if len(listening.tracks) >= count:
+                tracks.append((fields, plan.add(*cover) if cover else None))
+                if len(tracks) >= count:
                     break
 
-    artists = listenbrainz_artist_stats(sessions, count)
+    return tracks
+
+
+def music_artists(    # pylint: disable=too-many-arguments
+    count: int,
+    sessions: SessionCaches,
+    stores: DataStores,
+    period: str,
+    plan: EnrichmentPlan,
+    deadline: Optional[Deadline] = None,
+) -> List[Gathered]:
+    """
+    Gather the most listened to artists, adding their images to the enrichment plan
+    """
+
+    settings = get_settings()
+    artist_records: List[Gathered] = []
+
+    artists = artist_stats(sessions, stores, count, period, deadline)
     if 'payload' in artists and 'artists' in artists['payload']:
         for artist in artists['payload']['artists']:
-            image_url = None
             artist_url = None
-            artist_meta = {}
-            discogs_id = None
+            image = None
             if 'artist_mbid' in artist and artist['artist_mbid']:
-                artist_meta = musicbrainz_artist(mbid=artist['artist_mbid'], sessions=sessions)
-                if artist_meta and 'relations' in artist_meta:
-                    for rel in artist_meta['relations']:
-                        if rel['type'] == 'discogs':
-                            resource = URL(rel['url']['resource'])
-                            discogs_id = os.path.split(resource.path)[1]
-                            image_url = discogs_artist_image(
-                                discogsid=discogs_id,
-                                request=request,
-                                sessions=sessions
-                            )
-                            break
-
                 artist_url = f"{settings.musicbrainz_url}/artist/{artist['artist_mbid']}"
-
-            if image_url:
-                image = str(image_url)
-            else:
-                image = str(request.url_for('static', path='/heroicons/24/solid/musical-note.svg'))
+                image = plan.add('artist', artist['artist_mbid'])
 
             try:
-                listening.artists.append(
-                    Artist(
-                        name=artist['artist_name'],
-                        count=artist['listen_count'],
-                        url=artist_url,
-                        image=image
-                    )
-                )
+                fields = {
+                    'name': artist['artist_name'],
+                    'count': artist['listen_count'],
+                    'url': upstream_url(artist_url)
+                }
             except ValidationError:
-                pass
+                continue
 
-            if len(listening.artists) >= count:
+            artist_records.append((fields, image))
+            if len(artist_records) >= count:
                 break
 
-    releases = listenbrainz_release_stats(sessions, count)
+    return artist_records
+
+
+def music_releases(    # pylint: disable=too-many-arguments
+    count: int,
+    sessions: SessionCaches,
+    stores: DataStores,
+    period: str,
+    plan: EnrichmentPlan,
+    deadline: Optional[Deadline] = None,
+) -> List[Gathered]:
+    """
+    Gather the most listened to release groups, adding their cover art to the enrichment plan
+    """
+
+    settings = get_settings()
+    release_records: List[Gathered] = []
+
+    releases = release_stats(sessions, stores, count, period, deadline)
     if 'payload' in releases and 'release_groups' in releases['payload']:
         for release in releases['payload']['release_groups']:
-            image_url = None
-            groups_url = None
-
             if 'release_group_mbid' in release and release['release_group_mbid']:
-                caa_mbid = release['release_group_mbid']
-                image_url = coverart_image(
-                    mbid=caa_mbid,
-                    request=request,
-                    sessions=sessions,
-                    metadata='release-group'
-                )
                 groups_url = f"{settings.musicbrainz_url}/release-group/{release['release_group_mbid']}"
 
-                if image_url:
-                    image = str(image_url)
-                else:
-                    image = str(
-                        request.url_for('static',
-                                        path='/heroicons/24/solid/musical-note.svg')
-                    )
-
                 try:
-                    listening.releases.append(
-                        Release(
-                            artist=release['artist_name'],
-                            release=release['release_group_name'],
-                            url=groups_url,
-                            image=image
-                        )
-                    )
+                    fields = {
+                        'artist': release['artist_name'],
+                        'release': release['release_group_name'],
+                        'url': upstream_url(groups_url)
+                    }
                 except ValidationError:
-                    pass
+                    continue
 
-                if len(listening.releases) >= count:
+                release_records.append(
+                    (fields, plan.add('release-group', release['release_group_mbid']))
+                )
+                if len(release_records) >= count:
                     break
 
-    return listening
+    return release_records
+
+
+def out_of_time(deadline: Optional[Deadline]) -> bool:
+    """
+    Check whether a deadline has run out, so that anything looked up since may be missing
+    """
+
+    return deadline is not None and deadline.expired()
+
+
+def warm_cdn_url(url: URL) -> None:
+    """
+    Queue a signed CDN image URL to be warmed, if CDN warming is turned on
+    """
+
+    warmer = cdn_warmer()
+    if warmer is not None:
+        warmer.warm(url)
+
+
+def fetch_window(count: int) -> int:
+    """
+    Get how many items to fetch to be sure of count usable results: twice count rounded up to a
+    power of two, so that requests for different counts share upstream requests and cache entries
+    """
+
+    return min(1 << max(MIN_FETCH_WINDOW_BITS, (count * 2 - 1).bit_length()), LISTENBRAINZ_MAX_COUNT)
+
+
+def stats_window(period: str) -> Optional[int]:
+    """
+    Get the length in seconds of a named or custom (e.g. '36h', '2w') stats period, or None for
+    all time
+    """
+
+    if period in STATS_PERIODS:
+        return STATS_PERIODS[period]
+
+    try:
+        return int(humanfriendly.parse_timespan(period))
+    except humanfriendly.InvalidTimespan as exc:
+        raise ValueError(f'Invalid stats range: {period}') from exc
+
+
+def local_stats_since(stores: DataStores, period: str) -> Tuple[bool, Optional[int]]:
+    """
+    Work out when a stats period starts and whether the local listen counts should be used for it;
+    they're used unless they don't cover the whole period and ListenBrainz has stats for it
+    """
+
+    settings = get_settings()
+    window = stats_window(period)
+    since = int(time.time()) - window if window is not None else None
+    if settings.listening_stats == 'listenbrainz' and period in LISTENBRAINZ_PERIODS:
+        return False, since
+
+    counted_since = stores.listens.counted_since()
+    covered = counted_since is not None and since is not None and counted_since <= since
+    return covered or period not in LISTENBRAINZ_PERIODS, since
 
 
-def discogs_artist_image(discogsid: str, request: Request, sessions: SessionCaches) -> URL:
+def artist_stats(
+    sessions: SessionCaches,
+    stores: DataStores,
+    count: int,
+    period: str,
+    deadline: Optional[Deadline] = None,
+) -> dict:
+    """
+    Get the top artists for a period, from the local listen counts or ListenBrainz
+    """
+
+    local, since = local_stats_since(stores, period)
+    if not local:
+        return listenbrainz_artist_stats(sessions, count, period, deadline)
+
+    return {
+        'payload': {
+            'artists': [
+                {
+                    'artist_mbid': artist['mbid'],
+                    'artist_name': artist['name'],
+                    'listen_count': artist['listen_count']
+                } for artist in stores.listens.top('artist', since, fetch_window(count))
+            ]
+        }
+    }
+
+
+def release_stats(
+    sessions: SessionCaches,
+    stores: DataStores,
+    count: int,
+    period: str,
+    deadline: Optional[Deadline] = None,
+) -> dict:
+    """
+    Get the top release groups for a period, from the local listen counts or ListenBrainz
+
+    Listens only carry a release group MBID when their submitter sets one, so when the local
+    counts have none for a period ListenBrainz has stats for, its stats are used instead.
+    """
+
+    local, since = local_stats_since(stores, period)
+    if not local:
+        return listenbrainz_release_stats(sessions, count, period, deadline)
+
+    releases = stores.listens.top('release_group', since, fetch_window(count))
+    if not releases and period in LISTENBRAINZ_PERIODS:
+        return listenbrainz_release_stats(sessions, count, period, deadline)
+
+    return {
+        'payload': {
+            'release_groups': [
+                {
+                    'release_group_mbid': release['mbid'],
+                    'release_group_name': release['name'],
+                    'artist_name': release['artist_name'],
+                    'listen_count': release['listen_count']
+                } for release in releases
+            ]
+        }
+    }
+
+
+def discogs_artist_image(
+    discogsid: str,
+    icons: StaticIcons,
+    sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
+) -> URL:
     """
     Get artist image URL from Discogs
     """
@@ -171,7 +513,10 @@ def discogs_artist_image(discogsid: str, request: Request, sessions: SessionCach
     }
     url = f'{settings.discogs_api_url}/artists/{discogsid}'
 
-    rsp = sessions.images.get(url=url, headers=headers, timeout=settings.api_timeout)
+    rsp = budgeted_get(sessions.images, deadline, url=url, headers=headers)
+    if rsp is None:
+        return URL(icons.music)
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
@@ -190,15 +535,21 @@ def discogs_artist_image(discogsid: str, request: Request, sessions: SessionCach
 
         if image_url:
             image_url = signed_cdn_url(URL(image_url).replace(scheme='https'))
+            warm_cdn_url(image_url)
         else:
-            image_url = request.url_for('static', path='/heroicons/24/solid/musical-note.svg')
+            image_url = URL(icons.music)
 
         return image_url
 
     raise HTTPException(status_code=rsp.status_code, detail=rsp.json())
 
 
-def listenbrainz_artist_stats(sessions: SessionCaches, count: int, period: str = 'week') -> dict:
+def listenbrainz_artist_stats(
+    sessions: SessionCaches,
+    count: int,
+    period: str = 'week',
+    deadline: Optional[Deadline] = None,
+) -> dict:
     """
     Get artist stats from ListenBrainz
     """
@@ -208,11 +559,14 @@ def listenbrainz_artist_stats(sessions: SessionCaches, count: int, period: str =
         'Token': settings.listenbrainz_api_token
     }
     params = {
-        'count': count * 2,
+        'count': fetch_window(count),
         'range': period
     }
     url = f'{settings.listenbrainz_api_url}/stats/user/{settings.listenbrainz_api_user}/artists'
-    rsp = sessions.stats.get(url=url, headers=headers, params=params, timeout=settings.api_timeout)
+    rsp = budgeted_get(sessions.stats, deadline, url=url, headers=headers, params=params)
+    if rsp is None:
+        raise HTTPException(status_code=HTTPStatus.GATEWAY_TIMEOUT, detail='Out of time')
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
@@ -221,9 +575,63 @@ def listenbrainz_artist_stats(sessions: SessionCaches, count: int, period: str =
     raise HTTPException(status_code=rsp.status_code, detail=rsp.json())
 
 
-def listenbrainz_listens(sessions: SessionCaches, count: int) -> dict:
+def listenbrainz_listens(
+    sessions: SessionCaches,
+    stores: DataStores,
+    count: int,
+    deadline: Optional[Deadline] = None,
+) -> dict:
     """
-    Get user listens from ListenBrainz
+    Sync new listens from ListenBrainz into the local listen store and get the most recent
+    """
+
+    settings = get_settings()
+    page = min(settings.listens_sync_page, LISTENBRAINZ_MAX_COUNT)
+    min_ts = stores.listens.latest_timestamp()
+
+    try:
+        if min_ts is None:
+            stores.listens.add(
+                listenbrainz_listens_page(
+                    sessions,
+                    count=min(max(fetch_window(count), page), LISTENBRAINZ_MAX_COUNT),
+                    deadline=deadline
+                )
+            )
+
+        else:
+            # ListenBrainz returns the oldest listens after min_ts first, so keep paging forward
+            # until a short page says there's nothing newer
+            for _ in range(LISTENS_SYNC_MAX_PAGES):
+                listens = listenbrainz_listens_page(
+                    sessions, count=page, min_ts=min_ts, deadline=deadline
+                )
+                added = stores.listens.add(listens)
+                if len(listens) < page or not added:
+                    break
+                min_ts = max(listen['listened_at'] for listen in listens)
+
+    except UPSTREAM_ERRORS as exc:
+        if min_ts is None:
+            raise
+        logger.warning('Failed to sync listens, serving stored listens: %r', exc)
+
+    return {
+        'payload': {
+            'listens': stores.listens.recent(fetch_window(count))
+        }
+    }
+
+
+def listenbrainz_listens_page(
+    sessions: SessionCaches,
+    count: int,
+    min_ts: Optional[int] = None,
+    deadline: Optional[Deadline] = None,
+) -> List[dict]:
+    """
+    Get a page of user listens from ListenBrainz, optionally only those after min_ts; once the
+    deadline has run out, or no upstream turn comes in time, there are taken to be no new listens
     """
 
     settings = get_settings()
@@ -231,24 +639,30 @@ def listenbrainz_listens(sessions: SessionCaches, count: int) -> dict:
         'Token': settings.listenbrainz_api_token
     }
     params = {
-        'count': count * 2
+        'count': count
     }
+    if min_ts is not None:
+        params['min_ts'] = min_ts
+
     url = f'{settings.listenbrainz_api_url}/user/{settings.listenbrainz_api_user}/listens'
-    rsp = sessions.listens.get(
-        url=url,
-        headers=headers,
-        params=params,
-        timeout=settings.api_timeout
-    )
+    rsp = budgeted_get(sessions.listens, deadline, url=url, headers=headers, params=params)
+    if rsp is None:
+        return []
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
-        return rsp.json()
+        return rsp.json().get('payload', {}).get('listens', [])
 
     raise HTTPException(status_code=rsp.status_code, detail=rsp.json())
 
 
-def listenbrainz_release_stats(sessions: SessionCaches, count: int, period: str = 'week') -> dict:
+def listenbrainz_release_stats(
+    sessions: SessionCaches,
+    count: int,
+    period: str = 'week',
+    deadline: Optional[Deadline] = None,
+) -> dict:
     """
     Get release group stats from ListenBrainz
     """
@@ -258,11 +672,14 @@ def listenbrainz_release_stats(sessions: SessionCaches, count: int, period: str
         'Token': settings.listenbrainz_api_token
     }
     params = {
-        'count': count * 2,
+        'count': fetch_window(count),
         'range': period
     }
     url = f'{settings.listenbrainz_api_url}/stats/user/{settings.listenbrainz_api_user}/release-groups'
-    rsp = sessions.stats.get(url=url, headers=headers, params=params, timeout=settings.api_timeout)
+    rsp = budgeted_get(sessions.stats, deadline, url=url, headers=headers, params=params)
+    if rsp is None:
+        raise HTTPException(status_code=HTTPStatus.GATEWAY_TIMEOUT, detail='Out of time')
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
@@ -274,6 +691,7 @@ def listenbrainz_release_stats(sessions: SessionCaches, count: int, period: str
 def musicbrainz_artist(
     mbid: str,
     sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
 ) -> dict:
     """
     Get artist details from MusicBrainz
@@ -285,7 +703,10 @@ def musicbrainz_artist(
         'inc': 'url-rels'
     }
     url = f'{settings.musicbrainz_api_url}/artist/{mbid}'
-    rsp = sessions.artists.get(url=url, params=params, timeout=settings.api_timeout)
+    rsp = budgeted_get(sessions.artists, deadline, url=url, params=params)
+    if rsp is None:
+        return {}
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
@@ -296,9 +717,10 @@ def musicbrainz_artist(
 
 def coverart_image(
     mbid: str,
-    request: Request,
+    icons: StaticIcons,
     sessions: SessionCaches,
     metadata: str = 'release',
+    deadline: Optional[Deadline] = None,
 ) -> Optional[URL]:
     """
     Get release covert art image from CoverArtArchive
@@ -306,7 +728,10 @@ def coverart_image(
 
     settings = get_settings()
     url = f'{settings.coverart_api_url}/{metadata}/{mbid}'
-    rsp = sessions.images.get(url=url, timeout=settings.api_timeout)
+    rsp = budgeted_get(sessions.images, deadline, url=url)
+    if rsp is None:
+        return None
+
     logger.debug('%s: %s', url, rsp.status_code)
 
     if rsp.status_code == HTTPStatus.OK:
@@ -327,9 +752,10 @@ def coverart_image(
 
         if image_url:
             image_url = signed_cdn_url(URL(image_url).replace(scheme='https'))
+            warm_cdn_url(image_url)
 
         else:
-            image_url = request.url_for('static', path='/heroicons/24/solid/musical-note.svg')
+            image_url = URL(icons.music)
 
         return image_url
 
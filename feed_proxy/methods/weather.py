@@ -2,169 +2,345 @@
 Feed Proxy API: methods package; weather module
 """
 
+import bisect
+import datetime
 from http import HTTPStatus
 import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import Request
 from fastapi.exceptions import HTTPException
+import humanfriendly
+from requests import Response
 
 from feed_proxy.common.settings import get_settings
+from feed_proxy.common.weather_codes import WEATHER_CODES
 from feed_proxy.dependencies.cache import SessionCaches
-from feed_proxy.models.responses import CurrentWeather
+from feed_proxy.dependencies.geo import quantise, weather_index
+from feed_proxy.dependencies.icons import StaticIcons
+from feed_proxy.dependencies.upstream import Deadline, upstream_timeout
+from feed_proxy.models.records import CurrentWeatherRecord
+
+WEATHER_MODE_CURRENT = 'current'
+WEATHER_MODE_FORECAST = 'forecast'
+FORECAST_VARIABLES = 'temperature_2m,weathercode,is_day'
+DAY = 86400
 
 logger = logging.getLogger('gunicorn.error')
 
-WEATHER_CODES = {
-    0: {
-        'icon': 'clear-{day_night}',
-        'descr': 'clear sky'
-    },
-    1: {
-        'icon': 'partly-cloudy-{day_night}-haze',
-        'descr': 'mainly clear'
-    },
-    2: {
-        'icon': 'partly-cloudy-{day_night}',
-        'descr': 'partly cloudy'
-    },
-    3: {
-        'icon': 'overcast-{day_night}',
-        'descr': 'overcast'
-    },
-    45: {
-        'icon': 'fog-{day_night}',
-        'descr': 'fog'
-    },
-    48: {
-        'icon': 'extreme-{day_night}-fog',
-        'descr': 'depositing rime fog'
-    },
-    51: {
-        'icon': 'partly-cloudy-{day_night}-drizzle',
-        'descr': 'light drizzle'
-    },
-    53: {
-        'icon': 'overcast-{day_night}-drizzle',
-        'descr': 'moderate drizzle'
-    },
-    55: {
-        'icon': 'extreme-{day_night}-drizzle',
-        'descr': 'dense drizzle'
-    },
-    56: {
-        'icon': 'partly-cloudy-{day_night}-sleet',
-        'descr': 'light sleet'
-    },
-    57: {
-        'icon': 'extreme-{day_night}-sleet',
-        'descr': 'dense sleet'
-    },
-    61: {
-        'icon': 'partly-cloudy-{day_night}-rain',
-        'descr': 'slight rain'
-    },
-    63: {
-        'icon': 'overcast-{day_night}-rain',
-        'descr': 'moderate rain'
-    },
-    65: {
-        'icon': 'extreme-{day_night}-rain',
-        'descr': 'heavy rain'
-    },
-    66: {
-        'icon': 'partly-cloudy-{day_night}-sleet',
-        'descr': 'light freezing rain'
-    },
-    67: {
-        'icon': 'extreme-{day_night}-sleet',
-        'descr': 'heavy freezing rain'
-    },
-    71: {
-        'icon': 'partly-cloudy-{day_night}-snow',
-        'descr': 'slight snow'
-    },
-    73: {
-        'icon': 'overcast-{day_night}-snow',
-        'descr': 'moderate snow'
-    },
-    75: {
-        'icon': 'extreme-{day_night}-snow',
-        'descr': 'heavy snow'
-    },
-    77: {
-        'icon': 'snowflake',
-        'descr': 'snow'
-    },
-    80: {
-        'icon': 'partly-cloudy-{day_night}-rain',
-        'descr': 'slight showers'
-    },
-    81: {
-        'icon': 'overcast-{day_night}-rain',
-        'descr': 'moderate showers'
-    },
-    82: {
-        'icon': 'extreme-{day_night}-rain',
-        'descr': 'violent showers'
-    },
-    85: {
-        'icon': 'overcast-{day_night}-snow',
-        'descr': 'slight snow showers'
-    },
-    86: {
-        'icon': 'extreme-{day_night}-snow',
-        'descr': 'heavy show showers'
-    },
-    95: {
-        'icon': 'thunderstorms-{day_night}',
-        'descr': 'slight or moderate thunderstorms'
-    },
-    96: {
-        'icon': 'thunderstorms-{day_night}-snow',
-        'descr': 'thunderstorm and slight hail'
-    },
-    99: {
-        'icon': 'thunderstorms-{day_night}-extreme-snow',
-        'descr': 'thunderstorm and heavy hail'
+
+def forecast_mode() -> bool:
+    """
+    Check whether current weather is derived from a stored hourly forecast rather than asked for
+    """
+
+    return get_settings().weather_mode.lower() == WEATHER_MODE_FORECAST
+
+
+def forecast_expiry() -> float:
+    """
+    Get the number of seconds an hourly forecast is used for before it's fetched again
+    """
+
+    return humanfriendly.parse_timespan(get_settings().weather_forecast_expiry)
+
+
+def weather_params() -> dict:
+    """
+    Build the OpenMeteo parameters for the weather block of the configured weather mode; a forecast
+    covers the rest of today and every day it could still be used on
+    """
+
+    if forecast_mode():
+        return {
+            'hourly': FORECAST_VARIABLES,
+            'forecast_days': math.ceil(forecast_expiry() / DAY) + 1,
+            'timeformat': 'unixtime'
+        }
+
+    return {'current_weather': True}
+
+
+def weather_block(location: dict) -> dict:
+    """
+    Get the weather block of the configured weather mode from an OpenMeteo location
+    """
+
+    if forecast_mode():
+        return {'hourly': location['hourly']}
+
+    return location['current_weather']
+
+
+def weather_expire_after() -> dict:
+    """
+    Build the cache expiry override for OpenMeteo requests; a forecast is cached for as long as
+    it's used, otherwise the weather cache expiry applies
+    """
+
+    return {'expire_after': forecast_expiry()} if forecast_mode() else {}
+
+
+def response_expiry(rsp: Response) -> Optional[float]:
+    """
+    Get when a cached OpenMeteo response expires, as a timestamp, if it does
+    """
+
+    expires = getattr(rsp, 'expires', None)
+    return expires.replace(tzinfo=datetime.timezone.utc).timestamp() if expires else None
+
+
+def index_weather(lat: float, lng: float, block: dict, expires: Optional[float]) -> None:
+    """
+    Index a weather block for a point until the response it came from expires, so the index
+    never serves it for longer than the cache would
+    """
+
+    if expires is None and forecast_mode():
+        expires = time.time() + forecast_expiry()
+    weather_index().add(lat, lng, block, expires=expires)
+
+
+def forecast_current(block: dict, now: Optional[float] = None) -> Optional[dict]:
+    """
+    Derive current weather from an hourly forecast block, interpolating the temperature between
+    the hours either side of now and taking the weather code and day or night from the nearer
+    hour; None if the forecast doesn't cover now
+    """
+
+    hourly = block['hourly']
+    times = hourly['time']
+    now = time.time() if now is None else now
+    index = bisect.bisect_right(times, now) - 1
+    if index < 0 or index + 1 >= len(times):
+        return None
+
+    fraction = (now - times[index]) / (times[index + 1] - times[index])
+    nearest = index if fraction < 0.5 else index + 1
+    before, after = hourly['temperature_2m'][index], hourly['temperature_2m'][index + 1]
+    if before is None or after is None:
+        temperature = hourly['temperature_2m'][nearest]
+    else:
+        temperature = round(before + (after - before) * fraction, 1)
+
+    if temperature is None or hourly['weathercode'][nearest] is None:
+        return None
+
+    return {
+        'temperature': temperature,
+        'weathercode': hourly['weathercode'][nearest],
+        'is_day': hourly['is_day'][nearest]
     }
-}
+
+
+def current_conditions(block: dict) -> dict:
+    """
+    Get current weather from a weather block of the configured weather mode
+    """
+
+    if not forecast_mode():
+        return block
+
+    current = forecast_current(block)
+    if current is None:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_GATEWAY, detail='Forecast does not cover the current time'
+        )
+
+    return current
 
 
 def current_weather(
-    request: Request,
+    icons: StaticIcons,
     lng: float,
     lat: float,
-    sessions: SessionCaches
-) -> CurrentWeather:
+    sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
+) -> CurrentWeatherRecord:
     """
     Get current weather from OpenMeteo
     """
 
+    current = weather_index().nearest(lat, lng)
+    if current is None:
+        lat, lng = quantise(lat, lng)
+        current, expires = openmeteo_current_weather(
+            lng=lng, lat=lat, sessions=sessions, deadline=deadline
+        )
+        index_weather(lat, lng, current, expires)
+
+    return weather_record(icons, current_conditions(current))
+
+
+def batch_weather(
+    icons: StaticIcons,
+    points: List[Tuple[float, float]],
+    sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
+) -> List[dict]:
+    """
+    Get current weather for many points from OpenMeteo, fetching all the points that aren't
+    already cached in a single upstream request
+    """
+
+    current: Dict[Tuple[float, float], dict] = {}
+    quantised: Dict[Tuple[float, float], Tuple[float, float]] = {}
+    for lat, lng in points:
+        nearest = weather_index().nearest(lat, lng)
+        if nearest is not None:
+            current[(lat, lng)] = nearest
+            continue
+
+        point = quantise(lat, lng)
+        quantised[(lat, lng)] = point
+        if point not in current:
+            cached = cached_current_weather(lng=point[1], lat=point[0], sessions=sessions)
+            if cached is not None:
+                current[point], expires = cached
+                index_weather(point[0], point[1], current[point], expires)
+
+    uncached = list(dict.fromkeys(point for point in quantised.values() if point not in current))
+    if uncached:
+        fetched, expires = openmeteo_batch_weather(uncached, sessions, deadline)
+        for point, block in zip(uncached, fetched):
+            current[point] = block
+            index_weather(point[0], point[1], block, expires)
+
+    return [
+        {
+            'lat': lat,
+            'lng': lng,
+            'weather': weather_record(
+                icons, current_conditions(current[quantised.get((lat, lng), (lat, lng))])
+            ).dict()
+        }
+        for lat, lng in points
+    ]
+
+
+def openmeteo_current_weather(
+    lng: float,
+    lat: float,
+    sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[dict, Optional[float]]:
+    """
+    Get the weather block of the configured weather mode for a single point from OpenMeteo, and
+    when the response it came from expires
+    """
+
+    rsp = openmeteo_point_forecast(lng, lat, sessions, deadline=deadline)
+    return point_weather(rsp)
+
+
+def cached_current_weather(
+    lng: float,
+    lat: float,
+    sessions: SessionCaches,
+) -> Optional[Tuple[dict, Optional[float]]]:
+    """
+    Get the weather block of the configured weather mode for a single point, and when it expires,
+    if it's cached; None rather than calling upstream if it isn't
+    """
+
+    rsp = openmeteo_point_forecast(lng, lat, sessions, only_if_cached=True)
+    if rsp.status_code == HTTPStatus.GATEWAY_TIMEOUT:
+        return None
+
+    return point_weather(rsp)
+
+
+def openmeteo_point_forecast(
+    lng: float,
+    lat: float,
+    sessions: SessionCaches,
+    only_if_cached: bool = False,
+    deadline: Optional[Deadline] = None,
+) -> Response:
+    """
+    Request the forecast for a single point from OpenMeteo, or from the cache only if
+    only_if_cached is set
+    """
+
     settings = get_settings()
 
     params = {
         'latitude': lat,
         'longitude': lng,
-        'current_weather': True
+        **weather_params()
     }
 
     url = f'{settings.openmeteo_api_url}/forecast'
-    rsp = sessions.weather.get(url=url, params=params, timeout=settings.api_timeout)
+    rsp = sessions.weather.get(
+        url=url,
+        params=params,
+        timeout=upstream_timeout(deadline),
+        only_if_cached=only_if_cached,
+        **weather_expire_after()
+    )
     logger.debug('%s: %s', url, rsp.status_code)
+    return rsp
+
+
+def point_weather(rsp: Response) -> Tuple[dict, Optional[float]]:
+    """
+    Get the weather block and expiry from a single point's forecast response
+    """
+
+    if rsp.status_code != HTTPStatus.OK:
+        details = rsp.json() if rsp.text else {}
+        raise HTTPException(status_code=rsp.status_code, detail=details)
+
+    return weather_block(rsp.json()), response_expiry(rsp)
+
+
+def openmeteo_batch_weather(
+    points: List[Tuple[float, float]],
+    sessions: SessionCaches,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[dict], Optional[float]]:
+    """
+    Get the weather blocks of the configured weather mode for many points from OpenMeteo in a
+    single request, and when the response they came from expires
+    """
+
+    settings = get_settings()
+
+    params = {
+        'latitude': ','.join(str(lat) for lat, _lng in points),
+        'longitude': ','.join(str(lng) for _lat, lng in points),
+        **weather_params()
+    }
+
+    url = f'{settings.openmeteo_api_url}/forecast'
+    rsp = sessions.weather.get(
+        url=url, params=params, timeout=upstream_timeout(deadline), **weather_expire_after()
+    )
+    logger.debug('%s: %s (%s points)', url, rsp.status_code, len(points))
 
     if rsp.status_code != HTTPStatus.OK:
         details = rsp.json() if rsp.text else {}
         raise HTTPException(status_code=rsp.status_code, detail=details)
 
     body = rsp.json()
-    day_night = 'day' if body['current_weather']['is_day'] else 'night'
-    code = body['current_weather']['weathercode']
-    icon = WEATHER_CODES[code]['icon'].format(day_night=day_night)
-
-    weather = CurrentWeather(
-        temp=body['current_weather']['temperature'],
-        icon=str(request.url_for('static',
-                                 path=f'/weather-icons/fill/svg/{icon}.svg')),
+    # OpenMeteo returns a single object, not a list, for a single point
+    if isinstance(body, dict):
+        body = [body]
+
+    return [weather_block(location) for location in body], response_expiry(rsp)
+
+
+def weather_record(icons: StaticIcons, current: dict) -> CurrentWeatherRecord:
+    """
+    Build a current weather response from an OpenMeteo current weather block
+    """
+
+    day_night = 'day' if current['is_day'] else 'night'
+    code = current['weathercode']
+
+    return CurrentWeatherRecord(
+        temp=float(current['temperature']),
+        icon=icons.weather[(code, day_night)],
         descr=WEATHER_CODES[code]['descr']
     )
-    return weather
@@ -0,0 +1,133 @@
+"""
+Feed Proxy API: models package; trusted response records module
+
+The pydantic models in the responses module describe the API's response schemas. The records here
+are compact, slotted equivalents that are built from data this API has already produced or
+validated and so skip pydantic validation on construction and again on response serialisation.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import HttpUrl, parse_obj_as
+
+# A section was built in full; built, but missing some enrichment; replaced by its last known good
+# version; or not available at all
+SECTION_OK = 'ok'
+SECTION_DEGRADED = 'degraded'
+SECTION_STALE = 'stale'
+SECTION_FAILED = 'failed'
+
+
+class Record:    # pylint: disable=too-few-public-methods
+    """
+    Base for compact, slotted response records
+    """
+
+    __slots__: Tuple[str, ...] = ()
+
+    def dict(self) -> dict:
+        """
+        Return the record as a JSON serialisable dict
+        """
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+@dataclass
+class TrackRecord(Record):
+    """
+    A single music track
+    """
+
+    __slots__ = ('artist', 'track', 'image', 'url')
+
+    artist: str
+    track: str
+    image: str
+    url: str
+
+
+@dataclass
+class ArtistRecord(Record):
+    """
+    A single music artist
+    """
+
+    __slots__ = ('name', 'count', 'image', 'url')
+
+    name: str
+    count: int
+    image: str
+    url: str
+
+
+@dataclass
+class ReleaseRecord(Record):
+    """
+    A single music release
+    """
+
+    __slots__ = ('artist', 'release', 'image', 'url')
+
+    artist: str
+    release: str
+    image: str
+    url: str
+
+
+@dataclass
+class SectionStatusRecord(Record):
+    """
+    The status of a single response section, and when it was built if it's a stale copy
+    """
+
+    __slots__ = ('status', 'updated_at')
+
+    status: str
+    updated_at: Optional[int]
+
+
+@dataclass
+class CurrentMusicRecord:
+    """
+    All current music stats response
+    """
+
+    tracks: List[TrackRecord] = field(default_factory=list)
+    artists: List[ArtistRecord] = field(default_factory=list)
+    releases: List[ReleaseRecord] = field(default_factory=list)
+    status: Dict[str, SectionStatusRecord] = field(default_factory=dict)
+
+    def dict(self) -> dict:
+        """
+        Return the record as a JSON serialisable dict
+        """
+
+        return {
+            'tracks': [track.dict() for track in self.tracks],
+            'artists': [artist.dict() for artist in self.artists],
+            'releases': [release.dict() for release in self.releases],
+            'status': {name: status.dict() for name, status in self.status.items()}
+        }
+
+
+@dataclass
+class CurrentWeatherRecord(Record):
+    """
+    Current weather response
+    """
+
+    __slots__ = ('temp', 'icon', 'descr')
+
+    temp: float
+    icon: str
+    descr: str
+
+
+def upstream_url(url: Optional[str]) -> str:
+    """
+    Validate a URL built from upstream API data, raising a pydantic ValidationError if it's invalid
+    """
+
+    return str(parse_obj_as(HttpUrl, url))
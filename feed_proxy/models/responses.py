@@ -2,7 +2,7 @@
 Feed Proxy API: models package; responses module
 """
 
-from typing import List
+from typing import Dict, List, Optional
 from pydantic import BaseModel, HttpUrl
 
 
@@ -39,6 +39,16 @@ class Release(BaseModel):
     url: HttpUrl
 
 
+class SectionStatus(BaseModel):
+    """
+    The status of a single response section: ok, degraded (missing some enrichment), stale (the
+    last known good version, built at updated_at) or failed
+    """
+
+    status: str
+    updated_at: Optional[int]
+
+
 class CurrentMusic(BaseModel):
     """
     All current music stats response
@@ -47,6 +57,7 @@ class CurrentMusic(BaseModel):
     tracks: List[Track] = []
     artists: List[Artist] = []
     releases: List[Release] = []
+    status: Dict[str, SectionStatus] = {}
 
 
 class CurrentWeather(BaseModel):
@@ -57,3 +68,21 @@ class CurrentWeather(BaseModel):
     temp: float
     icon: HttpUrl
     descr: str
+
+
+class WeatherPoint(BaseModel):
+    """
+    Current weather for a single point
+    """
+
+    lat: float
+    lng: float
+    weather: CurrentWeather
+
+
+class BatchWeather(BaseModel):
+    """
+    Current weather for many points response
+    """
+
+    points: List[WeatherPoint] = []
@@ -0,0 +1,140 @@
+"""
+Feed Proxy API: routers package; admin route handlers module
+"""
+
+from http import HTTPStatus
+import logging
+import os
+from typing import List, Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Path, Query
+from fastapi.exceptions import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from feed_proxy.common.loopmonitor import loop_monitor
+from feed_proxy.common.metrics import metrics
+from feed_proxy.common.settings import get_settings
+from feed_proxy.dependencies.admin import admin_auth
+from feed_proxy.dependencies.cache import SessionCaches, sessions as caches
+from feed_proxy.dependencies.icons import StaticIcons, static_icons
+from feed_proxy.dependencies.maintenance import read_report
+from feed_proxy.dependencies.stores import DataStores, stores as data_stores
+from feed_proxy.methods.admin import FEEDS, cache_stats, purge_cache, warm_feed
+
+logger = logging.getLogger('gunicorn.error')
+
+settings = get_settings()
+router = APIRouter(
+    prefix=f'/{settings.feed_api_version}/admin',
+    dependencies=[Depends(admin_auth)],
+    include_in_schema=False
+)
+
+
+@router.get('/cache')
+async def cache_handler(sessions: SessionCaches = Depends(caches)) -> JSONResponse:
+    """
+    Get per category cache entry counts, sizes and hit rates
+    """
+
+    return JSONResponse(
+        status_code=HTTPStatus.OK, content=await run_in_threadpool(cache_stats, sessions)
+    )
+
+
+@router.delete('/cache')
+async def purge_handler(
+    prefix: Optional[str] = Query(default=None),
+    mbid: Optional[str] = Query(default=None),
+    category: Optional[List[str]] = Query(default=None),
+    sessions: SessionCaches = Depends(caches)
+) -> JSONResponse:
+    """
+    Purge cached responses by URL prefix or MusicBrainz ID
+    """
+
+    if not prefix and not mbid:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail='One of prefix or mbid is required'
+        )
+
+    purged = await run_in_threadpool(
+        purge_cache, sessions, prefix=prefix, mbid=mbid, categories=category
+    )
+    return JSONResponse(status_code=HTTPStatus.OK, content={'purged': purged})
+
+
+@router.get('/cache/maintenance')
+async def maintenance_handler() -> JSONResponse:
+    """
+    Get the most recent cache maintenance report
+    """
+
+    return JSONResponse(status_code=HTTPStatus.OK, content=read_report())
+
+
+@router.get('/metrics')
+async def metrics_handler() -> JSONResponse:
+    """
+    Get this worker's metrics
+    """
+
+    return JSONResponse(status_code=HTTPStatus.OK, content=metrics.snapshot())
+
+
+@router.get('/loop')
+async def loop_handler() -> JSONResponse:
+    """
+    Get this worker's event loop lag percentiles and the most recent blocking calls caught
+    """
+
+    monitor = loop_monitor()
+    if monitor is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail='The event loop monitor is turned off'
+        )
+
+    return JSONResponse(
+        status_code=HTTPStatus.OK, content={'worker': os.getpid(), **monitor.report()}
+    )
+
+
+@router.post('/warm/{feed}')
+async def warm_handler(    # pylint: disable=too-many-arguments
+    background_tasks: BackgroundTasks,
+    feed: str = Path(regex=f"^({'|'.join(FEEDS)})$"),
+    count: int = Query(default=8, ge=1, le=settings.listening_max_count),
+    lng: Optional[float] = Query(default=None,
+                                 ge=-180.0,
+                                 le=180.0),
+    lat: Optional[float] = Query(default=None,
+                                 ge=-90.0,
+                                 le=90.0),
+    icons: StaticIcons = Depends(static_icons),
+    sessions: SessionCaches = Depends(caches),
+    stores: DataStores = Depends(data_stores)
+) -> JSONResponse:
+    """
+    Warm the caches behind a feed in the background
+    """
+
+    background_tasks.add_task(
+        warm_feed,
+        feed,
+        icons=icons,
+        sessions=sessions,
+        stores=stores,
+        count=count,
+        lng=lng,
+        lat=lat
+    )
+    return JSONResponse(
+        status_code=HTTPStatus.ACCEPTED,
+        content={
+            'code': HTTPStatus.ACCEPTED,
+            'message': f'Warming {feed}'
+        }
+    )
@@ -2,17 +2,24 @@
 Feed Proxy API: routers package; route handlers module
 """
 
+from http import HTTPStatus
 import logging
+from typing import List, Tuple
 
-from fastapi import APIRouter, Depends, Query, Request
+from fastapi import APIRouter, Depends, Query
+from fastapi.exceptions import HTTPException
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
 from feed_proxy.common.settings import get_settings
 from feed_proxy.dependencies.cache import SessionCaches, sessions as caches
+from feed_proxy.dependencies.icons import StaticIcons, static_icons
+from feed_proxy.dependencies.stores import DataStores, stores as data_stores
+from feed_proxy.dependencies.upstream import Deadline, route_deadline
 from feed_proxy.methods.checkins import current_checkin
-from feed_proxy.methods.music import current_music
-from feed_proxy.methods.weather import current_weather
-from feed_proxy.models.responses import CurrentMusic, CurrentWeather
+from feed_proxy.methods.music import current_music, stats_window
+from feed_proxy.methods.weather import batch_weather, current_weather
+from feed_proxy.models.responses import BatchWeather, CurrentMusic, CurrentWeather
 
 STATUSLOG_JSON = 'statuslog.json'
 
@@ -24,40 +31,60 @@ router = APIRouter(prefix=f'/{settings.feed_api_version}')
 
 @router.get('/checkin')
 async def checkin_handler(
-    request: Request,
-    sessions: SessionCaches = Depends(caches)
+    icons: StaticIcons = Depends(static_icons),
+    sessions: SessionCaches = Depends(caches),
+    stores: DataStores = Depends(data_stores),
+    deadline: Deadline = Depends(route_deadline('checkin'))
 ) -> JSONResponse:
     """
     Get the current checkin from Swarm/Foursquare
     """
 
-    return current_checkin(request, sessions)
+    return await run_in_threadpool(current_checkin, icons, sessions, stores, deadline)
 
 
-@router.get('/listening')
-async def listening_handler(
-    request: Request,
-    count: int = Query(default=8),
-    sessions: SessionCaches = Depends(caches)
-) -> CurrentMusic:
+@router.get('/listening', response_model=CurrentMusic)
+async def listening_handler(    # pylint: disable=too-many-arguments
+    icons: StaticIcons = Depends(static_icons),
+    count: int = Query(default=8, ge=1, le=settings.listening_max_count),
+    period: str = Query(default='week', alias='range'),
+    sessions: SessionCaches = Depends(caches),
+    stores: DataStores = Depends(data_stores),
+    deadline: Deadline = Depends(route_deadline('listening'))
+) -> JSONResponse:
     """
     Get current music listens (AKA scrobbles) and stats from ListenBrainz
     """
 
-    return current_music(request=request, count=count, sessions=sessions)
+    try:
+        stats_window(period)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY, detail=str(exc)) from exc
+
+    listening = await run_in_threadpool(
+        current_music,
+        icons=icons,
+        count=count,
+        sessions=sessions,
+        stores=stores,
+        period=period,
+        deadline=deadline
+    )
+    return JSONResponse(content=listening.dict())
 
 
-@router.get('/weather')
+@router.get('/weather', response_model=CurrentWeather)
 async def weather_handler(
-    request: Request,
+    icons: StaticIcons = Depends(static_icons),
     lng: float = Query(default=None,
                        ge=-180.0,
                        le=180.0),
     lat: float = Query(default=None,
                        ge=-90.0,
                        le=90.0),
-    sessions: SessionCaches = Depends(caches)
-) -> CurrentWeather:
+    sessions: SessionCaches = Depends(caches),
+    deadline: Deadline = Depends(route_deadline('weather'))
+) -> JSONResponse:
     """
     Get current weather from OpenMeteo
     """
@@ -67,4 +94,53 @@ async def weather_handler(
     if not lat:
         lat = settings.default_lat
 
-    return current_weather(request=request, lng=lng, lat=lat, sessions=sessions)
+    weather = await run_in_threadpool(
+        current_weather, icons=icons, lng=lng, lat=lat, sessions=sessions, deadline=deadline
+    )
+    return JSONResponse(content=weather.dict())
+
+
+@router.get('/weather/batch', response_model=BatchWeather)
+async def batch_weather_handler(
+    icons: StaticIcons = Depends(static_icons),
+    point: List[str] = Query(description='lat,lng; repeat for each point'),
+    sessions: SessionCaches = Depends(caches),
+    deadline: Deadline = Depends(route_deadline('weather'))
+) -> JSONResponse:
+    """
+    Get current weather for many points from OpenMeteo
+    """
+
+    if len(point) > settings.weather_batch_max_points:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f'At most {settings.weather_batch_max_points} points are allowed'
+        )
+
+    points = [parse_point(value) for value in point]
+    weather = await run_in_threadpool(
+        batch_weather, icons=icons, points=points, sessions=sessions, deadline=deadline
+    )
+    return JSONResponse(content={'points': weather})
+
+
+def parse_point(value: str) -> Tuple[float, float]:
+    """
+    Parse and validate a lat,lng point
+    """
+
+    try:
+        lat, lng = (float(coord) for coord in value.split(','))
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f'Invalid point {value}; expected lat,lng'
+        ) from exc
+
+    if not -90.0 <= lat <= 90.0 or not -180.0 <= lng <= 180.0:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f'Point {value} is out of range'
+        )
+
+    return lat, lng
@@ -9,11 +9,24 @@ import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+import humanfriendly
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from feed_proxy.common.middleware import RouteLoggerMiddleware, TransactionTimeMiddleware
+from feed_proxy.common.logqueue import access_logger, start_access_log, stop_access_log
+from feed_proxy.common.loopmonitor import loop_monitor
+from feed_proxy.common.middleware import (
+    AdmissionMiddleware,
+    CompressionMiddleware,
+    RouteLoggerMiddleware,
+    TransactionTimeMiddleware,
+    UntrustedProxyMiddleware
+)
 from feed_proxy.common.settings import get_settings
+from feed_proxy.common.static import static_assets
+from feed_proxy.dependencies.cache import sessions
+from feed_proxy.dependencies.maintenance import CacheSweeper, access_recorder
+from feed_proxy.dependencies.ratelimit import ClientRateLimitMiddleware, client_buckets
+from feed_proxy.routers.admin import router as admin_router
 from feed_proxy.routers.routes import router
 
 # HTTPConnection.debuglevel = 1
@@ -29,13 +42,77 @@ settings = get_settings()
 debug = settings.environment.lower() != 'production'
 api = FastAPI(debug=debug, title='status.vicchi.org Feed Proxy API')
 
+api.add_middleware(
+    AdmissionMiddleware,
+    max_in_flight=settings.admission_max_in_flight,
+    max_queued=settings.admission_max_queued,
+    queue_timeout=humanfriendly.parse_timespan(settings.admission_queue_timeout),
+    retry_after=settings.admission_retry_after,
+    exempt_routes=['/ping', '/static', f'/{settings.feed_api_version}/admin']
+)
+api.add_middleware(
+    ClientRateLimitMiddleware,
+    upstream_cost=settings.client_upstream_cost,
+    exempt_routes=['/ping', '/static', f'/{settings.feed_api_version}/admin']
+)
 api.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET'], allow_headers=['*'])
+api.add_middleware(
+    CompressionMiddleware,
+    min_size=settings.response_compression_min_size,
+    gzip_level=settings.response_gzip_level,
+    brotli_quality=settings.response_brotli_quality,
+    cache_entries=settings.response_compression_cache_entries
+)
 api.add_middleware(TransactionTimeMiddleware)
-api.add_middleware(RouteLoggerMiddleware, level=logging.INFO, skip_regexes=['.*/ping'])
-api.add_middleware(ProxyHeadersMiddleware, trusted_hosts='*')
+api.add_middleware(
+    RouteLoggerMiddleware,
+    route_logger=access_logger,
+    level=logging.INFO,
+    skip_regexes=['.*/ping'],
+    sample_rate=settings.access_log_sample_rate
+)
+api.add_middleware(ProxyHeadersMiddleware, trusted_hosts=settings.forwarded_allow_ips)
+api.add_middleware(UntrustedProxyMiddleware, trusted_hosts=settings.forwarded_allow_ips)
 
 api.include_router(router)
-api.mount('/static', StaticFiles(directory=settings.static_path), name='static')
+api.include_router(admin_router)
+api.mount('/static', static_assets(), name='static')
+
+
+@api.on_event('startup')
+async def startup() -> None:
+    """
+    Open the cached sessions, load the static assets and start per worker background tasks,
+    including the access log writer, event loop monitor and client rate limit sync; this runs in
+    each worker, after any fork from a preloaded master and before the worker takes requests
+    """
+
+    api.state.access_log = start_access_log(settings.access_log_queue_size)
+    monitor = loop_monitor()
+    if monitor is not None:
+        monitor.start()
+    buckets = client_buckets()
+    if buckets is not None:
+        buckets.start()
+    static_assets().assets()
+    api.state.sweeper = CacheSweeper(sessions().databases(), access_recorder)
+    api.state.sweeper.start()
+
+
+@api.on_event('shutdown')
+async def shutdown() -> None:
+    """
+    Stop per worker background tasks
+    """
+
+    api.state.sweeper.stop()
+    monitor = loop_monitor()
+    if monitor is not None:
+        monitor.stop()
+    buckets = client_buckets()
+    if buckets is not None:
+        buckets.stop()
+    stop_access_log(api.state.access_log)
 
 
 @api.get('/ping')
@@ -4,18 +4,29 @@ Feed Proxy API: gunicorn config settings
 """
 
 import multiprocessing
+import os
+
+import dotenv
 
 # Server Mechanics: https://docs.gunicorn.org/en/latest/settings.html#server-mechanics
 daemon = False
 pidfile = 'run/api.pid'
 umask = 0o644
 worker_tmp_dir = '/dev/shm'
-forwarded_allow_ips = '*'
+# Only trust X-Forwarded-For from the reverse proxy, so clients can't choose their own address
+forwarded_allow_ips = os.environ.get(
+    'FORWARDED_ALLOW_IPS',
+    dotenv.dotenv_values(dotenv.find_dotenv()).get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+)
 
 # Worker Processes: https://docs.gunicorn.org/en/latest/settings.html#worker-processes
 workers = multiprocessing.cpu_count() * 2 + 1
 max_requests = 10000
+max_requests_jitter = 1000
 worker_class = 'uvicorn.workers.UvicornWorker'
+# Import the app once in the master; workers are forked from it and open their own caches, stores
+# and upstream connections on startup, so booting and recycling a worker is cheap
+preload_app = True
 
 # Logging: https://docs.gunicorn.org/en/stable/settings.html#logging
 # accesslog = '-'
@@ -0,0 +1,3 @@
+"""
+Feed Proxy API: tests package
+"""
@@ -0,0 +1,101 @@
+"""
+Feed Proxy API: tests package; shared configuration module
+"""
+
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+from feed_proxy.common.settings import get_settings
+
+TEST_DATA_PATH = Path(tempfile.mkdtemp(prefix='feed-proxy-tests-'))
+
+# Only the settings without a default are given; everything the tests write goes under a
+# temporary directory
+TEST_ENVIRONMENT = {
+    'SITE_HOST': 'www.example.org',
+    'SITE_URL': 'https://www.example.org',
+    'SITE_CONTACT': 'feed-proxy@example.org',
+    'ENVIRONMENT': 'test',
+    'TRAKT_BASE_URL': 'https://trakt.tv',
+    'TRAKT_AUTHORIZE_URL': '/oauth/authorize',
+    'TRAKT_API_URL': 'https://api.trakt.tv',
+    'TRAKT_TOKEN_URL': '/oauth/token',
+    'TRAKT_CLIENT_ID': 'test',
+    'TRAKT_SECRET': 'test',
+    'TRAKT_REDIRECT_URL': 'https://www.example.org/authorise',
+    'LASTFM_BASE_URL': 'https://www.last.fm',
+    'LASTFM_AUTHORIZE_URL': '/api/auth',
+    'LASTFM_API_URL': 'https://ws.audioscrobbler.com/2.0',
+    'LASTFM_SESSION_METHOD': 'auth.getSession',
+    'LASTFM_API_KEY': 'test',
+    'LASTFM_SECRET': 'test',
+    'LASTFM_REDIRECT_URL': 'https://www.example.org/authorise',
+    'FOURSQ_BASE_URL': 'https://foursquare.com',
+    'FOURSQ_AUTHORIZE_URL': '/oauth2/authenticate',
+    'FOURSQ_API_URL': 'https://api.foursquare.com',
+    'FOURSQ_TOKEN_URL': '/oauth2/access_token',
+    'FOURSQ_CLIENT_ID': 'test',
+    'FOURSQ_SECRET': 'test',
+    'FOURSQ_REDIRECT_URL': 'https://www.example.org/authorise',
+    'LASTFM_OAUTH_TOKEN': '',
+    'TRAKT_OAUTH_TOKEN': '',
+    'TRAKT_REFRESH_TOKEN': '',
+    'FOURSQ_OAUTH_TOKEN': '',
+    'TMDB_API_KEY': 'test',
+    'LISTENBRAINZ_API_URL': 'https://api.listenbrainz.org/1',
+    'LISTENBRAINZ_API_USER': 'test',
+    'LISTENBRAINZ_API_TOKEN': '',
+    'COVERART_API_URL': 'https://coverartarchive.org',
+    'OPENMETEO_API_URL': 'https://api.open-meteo.com/v1',
+    'DISCOGS_API_URL': 'https://api.discogs.com',
+    'DISCOGS_CONSUMER_KEY': 'test',
+    'DISCOGS_CONSUMER_SECRET': 'test',
+    'MUSICBRAINZ_URL': 'https://musicbrainz.org',
+    'MUSICBRAINZ_API_URL': 'https://musicbrainz.org/ws/2',
+    'DEFAULT_LNG': '-0.334835',
+    'DEFAULT_LAT': '51.426421',
+    'CACHE_PATH': str(TEST_DATA_PATH / 'cache'),
+    'CACHE_LISTENS_EXPIRY': '1h',
+    'CACHE_LISTENS': str(TEST_DATA_PATH / 'cache' / 'listens'),
+    'CACHE_STATS_EXPIRY': '1d',
+    'CACHE_STATS': str(TEST_DATA_PATH / 'cache' / 'stats'),
+    'CACHE_IMAGES_EXPIRY': '1w',
+    'CACHE_IMAGES': str(TEST_DATA_PATH / 'cache' / 'images'),
+    'CACHE_ARTISTS_EXPIRY': '1w',
+    'CACHE_ARTISTS': str(TEST_DATA_PATH / 'cache' / 'artists'),
+    'CACHE_WEATHER_EXPIRY': '1h',
+    'CACHE_WEATHER': str(TEST_DATA_PATH / 'cache' / 'weather'),
+    'CACHE_CHECKINS_EXPIRY': '1h',
+    'CACHE_CHECKINS': str(TEST_DATA_PATH / 'cache' / 'checkins'),
+    'STORE_PATH': str(TEST_DATA_PATH / 'stores'),
+    'STATIC_PATH': str(TEST_DATA_PATH / 'static'),
+    'CDN_BASE_URL': 'https://cdn.example.org',
+    'CDN_PATH': str(TEST_DATA_PATH / 'cdn'),
+    'CDN_SECRET': 'test',
+    'CDN_HASH_TYPE': 'sha256',
+    'CDN_HASH_SIZE': '40',
+    'CDN_IMAGE_HEIGHT': '350',
+    'CDN_IMAGE_WIDTH': '350',
+    'CDN_WARM': 'false',
+    'FEED_API_VERSION': 'v1',
+}
+
+for name, value in TEST_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+for path in ('cache', 'stores', 'static', 'cdn'):
+    (TEST_DATA_PATH / path).mkdir(parents=True, exist_ok=True)
+
+
+@pytest.fixture(autouse=True)
+def fresh_settings():
+    """
+    Re-read the settings for every test, so a test can change them with monkeypatch.setenv
+    """
+
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
@@ -0,0 +1,76 @@
+"""
+Feed Proxy API: tests package; weather index tests
+"""
+
+import time
+
+from feed_proxy.common.geo import KM_PER_DEGREE
+from feed_proxy.dependencies.geo import WeatherIndex
+
+LAT, LNG = 51.426421, -0.334835
+
+
+def test_nearest_within_radius():
+    """
+    The nearest fresh observation within the radius is found, and nothing beyond it
+    """
+
+    index = WeatherIndex(radius=5.0, expiry=3600)
+    index.add(LAT + 3 / KM_PER_DEGREE, LNG, {'name': 'three km'})
+    index.add(LAT + 1 / KM_PER_DEGREE, LNG, {'name': 'one km'})
+    index.add(LAT - 8 / KM_PER_DEGREE, LNG, {'name': 'eight km'})
+
+    assert index.nearest(LAT, LNG) == {'name': 'one km'}
+    assert index.nearest(LAT - 6 / KM_PER_DEGREE, LNG) == {'name': 'eight km'}
+    assert index.nearest(LAT + 20 / KM_PER_DEGREE, LNG) is None
+
+
+def test_nearest_across_cells():
+    """
+    Observations in neighbouring cells are found, including several columns away at high latitudes
+    """
+
+    index = WeatherIndex(radius=5.0, expiry=3600)
+    index.add(LAT + 4.9 / KM_PER_DEGREE, LNG, {'name': 'north'})
+    assert index.nearest(LAT, LNG) == {'name': 'north'}
+
+    # A degree of longitude at 70N is about a third of one at the equator, so 4 km east is a
+    # couple of cells over
+    index.add(70.0, 20.0 + 4 / (KM_PER_DEGREE * 0.342), {'name': 'arctic'})
+    assert index.nearest(70.0, 20.0) == {'name': 'arctic'}
+
+
+def test_nearest_skips_expired():
+    """
+    Expired observations are never served, even if they're closer
+    """
+
+    index = WeatherIndex(radius=5.0, expiry=3600)
+    index.add(LAT, LNG, {'name': 'expired'}, expires=time.time() - 1)
+    index.add(LAT + 2 / KM_PER_DEGREE, LNG, {'name': 'fresh'})
+
+    assert index.nearest(LAT, LNG) == {'name': 'fresh'}
+
+
+def test_nearest_replaces_point():
+    """
+    Adding an observation for a point already indexed replaces it
+    """
+
+    index = WeatherIndex(radius=5.0, expiry=3600)
+    index.add(LAT, LNG, {'name': 'old'})
+    index.add(LAT, LNG, {'name': 'new'})
+
+    assert index.nearest(LAT, LNG) == {'name': 'new'}
+
+
+def test_nearest_zero_radius():
+    """
+    With a zero radius only an observation for exactly the same point matches
+    """
+
+    index = WeatherIndex(radius=0.0, expiry=3600)
+    index.add(LAT, LNG, {'name': 'here'})
+
+    assert index.nearest(LAT, LNG) == {'name': 'here'}
+    assert index.nearest(LAT + 0.001, LNG) is None
@@ -0,0 +1,243 @@
+"""
+Feed Proxy API: tests package; middleware tests
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+
+import pytest
+
+from feed_proxy.common import middleware
+from feed_proxy.common.middleware import AdmissionMiddleware, negotiate_encoding, stale_responses
+
+
+@pytest.mark.parametrize(
+    'accept_encoding, expected', [
+        ('gzip, deflate, br', 'br'),
+        ('gzip', 'gzip'),
+        ('GZIP', 'gzip'),
+        ('br;q=0.5, gzip', 'gzip'),
+        ('br;q=1.0, gzip;q=0.8', 'br'),
+        ('*', 'br'),
+        ('*;q=0.5, br;q=0', 'gzip'),
+        ('gzip;q=0, br;q=0', None),
+        ('gzip;q=bogus', None),
+        ('identity', None),
+        ('', None),
+    ]
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    """
+    The best acceptable encoding is chosen, preferring brotli, and None if neither is acceptable
+    """
+
+    if middleware.brotli is None and expected == 'br':
+        pytest.skip('brotli is not installed')
+
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_negotiate_encoding_without_brotli(monkeypatch):
+    """
+    Without brotli installed gzip is the only encoding offered
+    """
+
+    monkeypatch.setattr(middleware, 'brotli', None)
+
+    assert negotiate_encoding('br, gzip') == 'gzip'
+    assert negotiate_encoding('br') is None
+
+
+class HeldApp:    # pylint: disable=too-few-public-methods
+    """
+    An ASGI app that answers requests to /held only once released, and any other path at once
+    """
+
+    def __init__(self) -> None:
+        self.released = asyncio.Event()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['path'] == '/held':
+            await self.released.wait()
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/plain')]
+        })
+        await send({'type': 'http.response.body', 'body': f"fresh {scope['path']}".encode()})
+
+
+async def request(
+    app, path: str, headers: Optional[List[Tuple[bytes, bytes]]] = None
+) -> Tuple[int, dict, bytes]:
+    """
+    Make a GET request to an ASGI app and return the response's status, headers and body
+    """
+
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': b'count=8',
+        'headers': headers or [],
+    }
+    await app(scope, receive, send)
+
+    start = messages[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return start['status'], response_headers, body
+
+
+@pytest.fixture(name='admission')
+def fixture_admission(tmp_path, monkeypatch):
+    """
+    Build admission middleware around a HeldApp, which handles one request at once and queues one
+    more for at most 50ms, with no stale responses stored yet
+    """
+
+    monkeypatch.setenv('CACHE_PATH', str(tmp_path))
+    stale_responses.cache_clear()
+
+    def build(max_queued: int = 1) -> Tuple[AdmissionMiddleware, HeldApp]:
+        app = HeldApp()
+        admission = AdmissionMiddleware(
+            app,    # type: ignore[arg-type]
+            max_in_flight=1,
+            max_queued=max_queued,
+            queue_timeout=0.05,
+            retry_after=7,
+            exempt_routes=['/admin']
+        )
+        return admission, app
+
+    yield build
+    stale_responses.cache_clear()
+
+
+async def hold(admission: AdmissionMiddleware) -> asyncio.Task:
+    """
+    Start a request that holds the only slot until the app is released
+    """
+
+    task = asyncio.create_task(request(admission, '/held'))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_admits_when_idle(admission):
+    """
+    Requests are handled as normal while there are free slots
+    """
+
+    async def run():
+        gate, _ = admission()
+        return await request(gate, '/feed')
+
+    status, _, body = asyncio.run(run())
+    assert status == 200
+    assert body == b'fresh /feed'
+
+
+def test_sheds_when_queue_full(admission):
+    """
+    A request beyond the queue is shed at once with a 503 and Retry-After
+    """
+
+    async def run():
+        gate, app = admission(max_queued=0)
+        held = await hold(gate)
+        shed = await request(gate, '/feed')
+        app.released.set()
+        return shed, await held
+
+    (status, headers, _), (held_status, _, _) = asyncio.run(run())
+    assert status == 503
+    assert headers['retry-after'] == '7'
+    assert held_status == 200
+
+
+def test_sheds_after_queue_timeout(admission):
+    """
+    A queued request that waits too long for a slot is shed
+    """
+
+    async def run():
+        gate, app = admission()
+        held = await hold(gate)
+        shed = await request(gate, '/feed')
+        app.released.set()
+        await held
+        return shed
+
+    status, _, _ = asyncio.run(run())
+    assert status == 503
+
+
+def test_queued_request_gets_slot(admission):
+    """
+    A queued request is handled once a slot frees up in time
+    """
+
+    async def run():
+        gate, app = admission()
+        held = await hold(gate)
+        queued = asyncio.create_task(request(gate, '/feed'))
+        await asyncio.sleep(0)
+        app.released.set()
+        await held
+        return await queued
+
+    status, _, body = asyncio.run(run())
+    assert status == 200
+    assert body == b'fresh /feed'
+
+
+def test_shed_request_gets_stale_response(admission):
+    """
+    A shed request gets the last successful response to the same request, marked as stale, but
+    not if it has credentials
+    """
+
+    async def run():
+        gate, app = admission(max_queued=0)
+        await request(gate, '/feed')
+        held = await hold(gate)
+        stale = await request(gate, '/feed')
+        credentialed = await request(gate, '/feed', [(b'authorization', b'Bearer token')])
+        app.released.set()
+        await held
+        return stale, credentialed
+
+    (status, headers, body), (credentialed_status, _, _) = asyncio.run(run())
+    assert status == 200
+    assert body == b'fresh /feed'
+    assert headers['warning'] == '110 - "Response is Stale"'
+    assert credentialed_status == 503
+
+
+def test_exempt_routes_never_shed(admission):
+    """
+    Exempt routes are handled even when every slot and the queue are taken
+    """
+
+    async def run():
+        gate, app = admission(max_queued=0)
+        held = await hold(gate)
+        exempt = await request(gate, '/admin/cache')
+        app.released.set()
+        await held
+        return exempt
+
+    status, _, body = asyncio.run(run())
+    assert status == 200
+    assert body == b'fresh /admin/cache'
@@ -0,0 +1,61 @@
+"""
+Feed Proxy API: tests package; music method tests
+"""
+
+import pytest
+
+from feed_proxy.methods.music import LISTENBRAINZ_MAX_COUNT, fetch_window, stats_window
+
+
+@pytest.mark.parametrize(
+    'period, expected', [
+        ('week', 7 * 86400),
+        ('all_time', None),
+        ('36h', 36 * 3600),
+        ('2w', 14 * 86400),
+    ]
+)
+def test_stats_window(period, expected):
+    """
+    Named and custom stats periods give their length in seconds, or None for all time
+    """
+
+    assert stats_window(period) == expected
+
+
+@pytest.mark.parametrize('period', ['fortnightly', '', '3 parsecs'])
+def test_stats_window_invalid(period):
+    """
+    Unknown periods raise ValueError
+    """
+
+    with pytest.raises(ValueError):
+        stats_window(period)
+
+
+@pytest.mark.parametrize(
+    'count, expected', [
+        (1, 8),
+        (4, 8),
+        (5, 16),
+        (8, 16),
+        (9, 32),
+        (100, 256),
+        (600, LISTENBRAINZ_MAX_COUNT),
+    ]
+)
+def test_fetch_window(count, expected):
+    """
+    The fetch window is at least twice the count, as a power of two no bigger than ListenBrainz
+    allows
+    """
+
+    assert fetch_window(count) == expected
+
+
+def test_fetch_window_shared():
+    """
+    Nearby counts share a fetch window, so they share upstream requests
+    """
+
+    assert len({fetch_window(count) for count in range(1, 51)}) == 5
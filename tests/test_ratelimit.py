@@ -0,0 +1,103 @@
+"""
+Feed Proxy API: tests package; client rate limiting tests
+"""
+
+import pytest
+
+from feed_proxy.dependencies.ratelimit import BucketStore, ClientBuckets
+
+# Slow enough that buckets don't noticeably refill while a test runs
+RATE = 0.01
+CAPACITY = 3.0
+
+
+@pytest.fixture(name='bucket_store')
+def fixture_bucket_store(tmp_path):
+    """
+    An empty shared bucket store
+    """
+
+    return BucketStore(tmp_path / 'clients.sqlite')
+
+
+def client_buckets(bucket_store: BucketStore) -> ClientBuckets:
+    """
+    Build one worker's client buckets, without starting its sync thread
+    """
+
+    return ClientBuckets(bucket_store, rate=RATE, capacity=CAPACITY, interval=60)
+
+
+def test_take(bucket_store):
+    """
+    A client can take a full bucket of tokens, then has to wait for one to refill
+    """
+
+    buckets = client_buckets(bucket_store)
+
+    assert [buckets.take('client') for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take('client') == pytest.approx(1 / RATE, rel=0.01)
+    assert buckets.take('other') == 0.0
+
+
+def test_charge(bucket_store):
+    """
+    Charging runs a bucket into debt of at most a full bucket, which has to refill before the
+    next take
+    """
+
+    buckets = client_buckets(bucket_store)
+    buckets.charge('client', 2.0)
+    assert buckets.take('client') == 0.0
+    assert buckets.take('client') > 0.0
+
+    buckets.charge('client', 100.0)
+    assert buckets.take('client') == pytest.approx((1 + CAPACITY) / RATE, rel=0.01)
+
+
+def test_sync(bucket_store):
+    """
+    Syncing shares what each worker has spent, so a client's tokens are shared across workers
+    """
+
+    first, second = client_buckets(bucket_store), client_buckets(bucket_store)
+    for _ in range(2):
+        assert first.take('client') == 0.0
+    first.sync()
+
+    assert second.take('client') == 0.0
+    second.sync()
+    assert second.take('client') == pytest.approx(1 / RATE, rel=0.01)
+
+    first.sync()
+    assert first.take('client') > 0.0
+
+
+def test_sync_keeps_unsynced_spend(bucket_store):
+    """
+    Spending after a sync is still taken from the shared bucket by the next one
+    """
+
+    first, second = client_buckets(bucket_store), client_buckets(bucket_store)
+    first.charge('client', 1.0)
+    first.sync()
+    first.charge('client', 1.0)
+    first.sync()
+
+    assert second.take('client') == 0.0
+    second.sync()
+    assert second.take('client') > 0.0
+
+
+def test_stop_pushes_spend(bucket_store):
+    """
+    Stopping pushes what's been spent since the last sync
+    """
+
+    first, second = client_buckets(bucket_store), client_buckets(bucket_store)
+    first.charge('client', CAPACITY)
+    first.stop()
+
+    second.charge('client', 0.0)
+    second.sync()
+    assert second.take('client') > 0.0
@@ -0,0 +1,109 @@
+"""
+Feed Proxy API: tests package; compact cache serializer tests
+"""
+
+import datetime
+import zlib
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+from requests_cache import CachedResponse
+from requests_cache.models import CachedRequest
+
+from feed_proxy.dependencies.serializers import CompactStage
+
+URL = 'https://api.listenbrainz.org/1/user/test/listens?count=8'
+
+
+def cached_response(content: bytes = b'{"payload": {}}') -> CachedResponse:
+    """
+    Build a cached response like one requests_cache would store
+    """
+
+    return CachedResponse(    # pylint: disable=unexpected-keyword-arg
+        content=content,
+        status_code=200,
+        reason='OK',
+        url=URL,
+        encoding='utf-8',
+        headers=CaseInsensitiveDict({
+            'Content-Type': 'application/json',
+            'ETag': '"abc"',
+            'Set-Cookie': 'session=secret',
+        }),
+        created_at=datetime.datetime(2023, 6, 1, 12, 0, 0),
+        expires=datetime.datetime(2023, 6, 1, 13, 0, 0),
+        request=CachedRequest(method='GET', url=URL)
+    )
+
+
+@pytest.mark.parametrize('zdict', [None, b'"payload": {"listens": []}'])
+def test_round_trip(zdict):
+    """
+    A response loads back with its status, kept headers, timestamps and body
+    """
+
+    stage = CompactStage(level=6, zdict=zdict)
+    loaded = stage.loads(stage.dumps(cached_response()))
+
+    assert loaded.status_code == 200
+    assert loaded.reason == 'OK'
+    assert loaded.url == URL
+    assert loaded.encoding == 'utf-8'
+    assert loaded.content == b'{"payload": {}}'
+    assert loaded.headers['Content-Type'] == 'application/json'
+    assert loaded.headers['ETag'] == '"abc"'
+    assert 'Set-Cookie' not in loaded.headers
+    assert loaded.created_at == datetime.datetime(2023, 6, 1, 12, 0, 0)
+    assert loaded.expires == datetime.datetime(2023, 6, 1, 13, 0, 0)
+    assert loaded.request.url == URL
+
+
+def test_round_trip_binary_body():
+    """
+    A body containing NUL bytes isn't confused with the end of the metadata
+    """
+
+    stage = CompactStage()
+    content = b'\0\x89PNG\0' * 100
+    assert stage.loads(stage.dumps(cached_response(content))).content == content
+
+
+def test_different_dictionary_is_a_miss():
+    """
+    An entry written with another dictionary, or by another serializer, raises ValueError
+    """
+
+    value = CompactStage(zdict=b'one dictionary').dumps(cached_response())
+
+    with pytest.raises(ValueError):
+        CompactStage(zdict=b'another dictionary').loads(value)
+    with pytest.raises(ValueError):
+        CompactStage().loads(b'not a compact entry')
+
+
+def test_corrupt_entry_is_a_miss():
+    """
+    A truncated or corrupted entry raises ValueError rather than loading part of the body
+    """
+
+    stage = CompactStage()
+    value = stage.dumps(cached_response(bytes(range(256)) * 64))
+
+    with pytest.raises(ValueError):
+        stage.loads(value[:len(value) // 2])
+    with pytest.raises(ValueError):
+        stage.loads(value[:len(value) // 2] + b'\xff' * 16)
+
+
+def test_url():
+    """
+    The URL is read without loading the response, and unreadable entries give None
+    """
+
+    stage = CompactStage()
+    value = stage.dumps(cached_response(zlib.compress(bytes(range(256)) * 1024)))
+
+    assert stage.url(value) == URL
+    assert stage.url(b'not a compact entry') is None
+    assert CompactStage(zdict=b'another dictionary').url(value) is None
@@ -0,0 +1,140 @@
+"""
+Feed Proxy API: tests package; local data store tests
+"""
+
+from typing import Optional
+
+import pytest
+
+from feed_proxy.dependencies.stores import ListenStore
+
+HOUR = 3600
+START = 1685620800    # 2023-06-01T12:00:00Z
+
+
+def listen(
+    listened_at: int, track: str, artist: str = 'Artist', release: Optional[str] = None
+) -> dict:
+    """
+    Build a listen like the ones ListenBrainz returns
+    """
+
+    meta: dict = {
+        'artist_name': artist,
+        'track_name': track,
+    }
+    if release:
+        meta['release_name'] = release
+        meta['mbid_mapping'] = {
+            'artists': [{
+                'artist_mbid': f'{artist.lower()}-mbid',
+                'artist_credit_name': artist,
+            }],
+            'release_group_mbid': f'{release.lower()}-mbid',
+        }
+
+    return {
+        'listened_at': listened_at,
+        'recording_msid': f'{listened_at}-{track}',
+        'track_metadata': meta,
+    }
+
+
+@pytest.fixture(name='listen_store')
+def fixture_listen_store(tmp_path):
+    """
+    An empty listen store capped at five listens
+    """
+
+    return ListenStore(tmp_path / 'listens.sqlite', max_listens=5)
+
+
+def test_add(listen_store):
+    """
+    New listens are stored newest first and already stored or undated listens are ignored
+    """
+
+    assert listen_store.add([listen(START, 'one'), listen(START + 60, 'two')]) == 2
+    assert listen_store.add([listen(START + 60, 'two'), {'track_metadata': {}}]) == 0
+
+    assert [item['track_metadata']['track_name'] for item in listen_store.recent(10)] == [
+        'two',
+        'one',
+    ]
+    assert listen_store.latest_timestamp() == START + 60
+
+
+def test_add_without_msid(listen_store):
+    """
+    Listens without a recording MSID are told apart by artist and track
+    """
+
+    first, second = listen(START, 'one'), listen(START, 'two')
+    del first['recording_msid']
+    del second['recording_msid']
+
+    assert listen_store.add([first, second, first]) == 2
+
+
+def test_cap(listen_store):
+    """
+    Only the newest max_listens listens are kept, but every listen stays counted
+    """
+
+    listen_store.add([listen(START + n * 60, f'track {n}') for n in range(8)])
+
+    recent = listen_store.recent(10)
+    assert [item['listened_at'] for item in recent] == [START + n * 60 for n in range(7, 2, -1)]
+    assert listen_store.counted_since() == START // HOUR * HOUR
+    assert listen_store.top('artist', None, 1)[0]['listen_count'] == 8
+
+
+def test_top(listen_store):
+    """
+    Artists and release groups are ranked by listens since a timestamp, or of all time
+    """
+
+    listen_store.add([
+        listen(START, 'one', 'Older', 'Past'),
+        listen(START + HOUR, 'two', 'Older', 'Past'),
+        listen(START + 2 * HOUR, 'three', 'Newer', 'Present'),
+    ])
+
+    assert listen_store.top('artist', None, 10) == [
+        {
+            'mbid': 'older-mbid',
+            'name': 'Older',
+            'artist_name': None,
+            'listen_count': 2
+        },
+        {
+            'mbid': 'newer-mbid',
+            'name': 'Newer',
+            'artist_name': None,
+            'listen_count': 1
+        },
+    ]
+    assert [item['name'] for item in listen_store.top('artist', START + HOUR, 10)] == [
+        'Newer',
+        'Older',
+    ]
+    assert listen_store.top('release_group', START + 2 * HOUR, 10) == [{
+        'mbid': 'present-mbid',
+        'name': 'Present',
+        'artist_name': 'Newer',
+        'listen_count': 1
+    }]
+    assert len(listen_store.top('artist', None, 1)) == 1
+
+
+def test_top_without_mbids(listen_store):
+    """
+    Artists without MusicBrainz IDs are counted by name, ignoring case
+    """
+
+    listen_store.add([listen(START, 'one', 'Unmapped'), listen(START + 60, 'two', 'UNMAPPED')])
+
+    top = listen_store.top('artist', None, 10)
+    assert len(top) == 1
+    assert top[0]['mbid'] is None
+    assert top[0]['listen_count'] == 2
@@ -0,0 +1,79 @@
+"""
+Feed Proxy API: tests package; weather method tests
+"""
+
+from feed_proxy.methods.weather import forecast_current
+
+HOUR = 3600
+START = 1685620800    # 2023-06-01T12:00:00Z
+
+
+def forecast(temperatures: list, weathercodes: list, is_day: list) -> dict:
+    """
+    Build an hourly forecast block, with Unix times, starting at START
+    """
+
+    return {
+        'hourly': {
+            'time': [START + n * HOUR for n in range(len(temperatures))],
+            'temperature_2m': temperatures,
+            'weathercode': weathercodes,
+            'is_day': is_day,
+        }
+    }
+
+
+def test_interpolates_temperature():
+    """
+    The temperature is interpolated between the hours either side of now
+    """
+
+    block = forecast([10.0, 14.0, 12.0], [0, 3, 61], [1, 1, 0])
+
+    assert forecast_current(block, START)['temperature'] == 10.0
+    assert forecast_current(block, START + HOUR / 4)['temperature'] == 11.0
+    assert forecast_current(block, START + HOUR * 1.5)['temperature'] == 13.0
+
+
+def test_nearest_hour_conditions():
+    """
+    The weather code and day or night come from the nearer hour
+    """
+
+    block = forecast([10.0, 14.0, 12.0], [0, 3, 61], [1, 1, 0])
+
+    assert forecast_current(block, START + HOUR * 0.4) == {
+        'temperature': 11.6,
+        'weathercode': 0,
+        'is_day': 1
+    }
+    assert forecast_current(block, START + HOUR * 1.6) == {
+        'temperature': 12.8,
+        'weathercode': 61,
+        'is_day': 0
+    }
+
+
+def test_missing_values():
+    """
+    A missing temperature either side falls back to the nearer hour's, and a missing value there
+    gives None
+    """
+
+    block = forecast([10.0, None, None], [0, 3, None], [1, 1, 0])
+
+    assert forecast_current(block, START + HOUR * 0.25)['temperature'] == 10.0
+    assert forecast_current(block, START + HOUR * 0.75) is None
+    assert forecast_current(block, START + HOUR * 1.75) is None
+
+
+def test_outside_forecast():
+    """
+    Times before the first hour or from the last hour on aren't covered
+    """
+
+    block = forecast([10.0, 14.0], [0, 3], [1, 1])
+
+    assert forecast_current(block, START - 1) is None
+    assert forecast_current(block, START + HOUR) is None
+    assert forecast_current(block, START + HOUR / 2) is not None
@@ -0,0 +1,74 @@
+"""
+Feed Proxy tools: Build a shared compression dictionary for a cache category
+
+Usage: python -m tools.cache_dictionary <category>
+
+Samples the response bodies currently held in a category's cache and writes a zlib preset
+dictionary to $CACHE_DICTIONARIES/<category>.dict. Entries written with a previous dictionary
+become cache misses and are refreshed from upstream as they're next requested.
+"""
+
+import argparse
+from pathlib import Path
+import sys
+
+from requests_cache import SQLiteCache
+
+from feed_proxy.common.settings import get_settings
+from feed_proxy.dependencies.serializers import compact_serializer
+
+CATEGORIES = ['listens', 'stats', 'images', 'artists', 'weather', 'checkins']
+
+# zlib only ever looks back 32 KiB, so anything before the final 32 KiB of a preset dictionary
+# is never used
+MAX_DICTIONARY_SIZE = 32 * 1024
+DEFAULT_SAMPLES = 64
+
+
+def build_dictionary(category: str, samples: int) -> bytes:
+    """
+    Build a preset dictionary from the most recently expiring responses in a category's cache
+    """
+
+    cache_path = getattr(settings, f'cache_{category}')
+    cache = SQLiteCache(db_path=cache_path.absolute(), serializer=compact_serializer(category))
+    bodies = [
+        response.content
+        for response in cache.sorted(key='expires', reversed=True, limit=samples)
+        if response.content
+    ]
+
+    # zlib favours matches nearer the end of the dictionary, so put the newest samples last
+    return b''.join(reversed(bodies))[-MAX_DICTIONARY_SIZE:]
+
+
+def main() -> int:
+    """
+    Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description='Build a cache compression dictionary')
+    parser.add_argument('category', choices=CATEGORIES)
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES)
+    args = parser.parse_args()
+
+    if not settings.cache_dictionaries:
+        print('CACHE_DICTIONARIES is not set', file=sys.stderr)
+        return 1
+
+    dictionary = build_dictionary(args.category, args.samples)
+    if not dictionary:
+        print(f'No cached {args.category} responses to sample', file=sys.stderr)
+        return 1
+
+    path = Path(settings.cache_dictionaries) / f'{args.category}.dict'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(dictionary)
+    print(f'Wrote {len(dictionary)} byte dictionary to {path}')
+    return 0
+
+
+settings = get_settings()
+
+if __name__ == '__main__':
+    sys.exit(main())